@@ -0,0 +1,386 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+""" Idle-wake to popup latency benchmark
+
+Runs mpnotd against the stand-in MPD server in fakempd.py with popups
+going to the recording backend, and reports per scenario:
+
+    p50/p99 from idle wake to popup and to popup artwork
+    popups shown for songs that were already skipped
+    artwork index hit rate on the popup path and for prefetch
+    CPU seconds and peak RSS of the mpnotd process
+
+Each scenario runs in its own process so CPU and RSS are not shared.
+
+    python benchmarks/bench_latency.py
+    python benchmarks/bench_latency.py --scenario skip_storm --albums 500
+"""
+
+import argparse
+import hashlib
+import json
+import math
+import multiprocessing
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+from os import makedirs, path
+
+sys.path.insert(0, path.dirname(path.dirname(path.abspath(__file__))))
+
+import fakempd  # noqa: E402
+
+SCENARIOS = ["track_changes", "skip_storm", "output_toggle", "db_update",
+             "mixed"]
+
+
+def make_music_dir(root, albums, cover_size, mpd_art=False):
+    """ Write a cover.jpg into every album directory of make_library()
+
+    With `mpd_art` the covers are returned instead, keyed by album
+    dir, for the stand-in server to send over albumart
+    """
+
+    import io
+
+    from PIL import Image
+
+    covers = {}
+
+    gradient = Image.linear_gradient("L").resize((cover_size, cover_size))
+
+    for num in range(albums):
+        artist = "Artist {:03d}".format(num % max(albums // 4, 1))
+        album_dir = path.join(root, artist, "Album {:03d}".format(num))
+        makedirs(album_dir, exist_ok=True)
+
+        blue = Image.new("L", gradient.size, (num * 37) % 256)
+        cover = Image.merge("RGB", (gradient, gradient.rotate(90), blue))
+
+        if mpd_art:
+            data = io.BytesIO()
+            cover.save(data, "JPEG", quality=90)
+            covers[path.relpath(album_dir, root)] = data.getvalue()
+        else:
+            cover.save(path.join(album_dir, "cover.jpg"), quality=90)
+
+    return covers
+
+
+def make_cache_dir(root, entries):
+    """ Fill the artwork cache with `entries` unrelated thumbnails
+    """
+
+    for num in range(entries):
+        key = hashlib.sha1(str(num).encode()).hexdigest()
+        shard = path.join(root, "art", key[:2], key[2:4])
+        makedirs(shard, exist_ok=True)
+
+        with open(path.join(shard, "{}-96.jpg".format(key)), "wb") as thumb:
+            thumb.write(b"\xff" * 2048)
+
+
+def percentile(values, pct):
+    """ Nearest rank percentile, None for no values
+    """
+
+    if not values:
+        return None
+
+    values = sorted(values)
+    return values[max(int(math.ceil(pct / 100.0 * len(values))) - 1, 0)]
+
+
+def run_scenario(args):
+    """ Run one scenario in this process, return result dict
+    """
+
+    # Covers and cache are removed again, they add up over runs
+    with tempfile.TemporaryDirectory(prefix="mpnotd-bench-") as workdir:
+        return _run_scenario(args, workdir)
+
+
+def _run_scenario(args, workdir):
+
+    import mpnotd
+
+    musicdir = path.join(workdir, "music")
+    cachedir = path.join(workdir, "cache")
+    configdir = path.join(workdir, "config")
+
+    covers = make_music_dir(musicdir, args.albums, args.cover_size,
+                            args.mpd_art)
+    make_cache_dir(cachedir, args.cache_entries)
+
+    # Stand-in MPD in its own process, kept out of our CPU numbers
+    songs = fakempd.make_library(args.albums, args.tracks)
+    trace = fakempd.make_trace(args.scenario, args.count, args.interval)
+
+    ctx = multiprocessing.get_context("spawn")
+    ready, results = ctx.Queue(), ctx.Queue()
+    server = ctx.Process(target=fakempd.run,
+                         args=(songs, trace, ready, results, 1.0, covers),
+                         daemon=True)
+    server.start()
+    port = ready.get(timeout=30)
+
+    makedirs(configdir)
+    with open(path.join(configdir, "config"), "w") as config:
+        config.write("\n".join([
+            "[mpnotd]",
+            "host = 127.0.0.1",
+            "port = {}".format(port),
+            "music = {}".format(musicdir),
+            "debounce = {}".format(args.debounce),
+            "prefetch = {}".format(args.prefetch),
+            "popup_interval = {}".format(args.popup_interval),
+            "state_file = {}".format(path.join(workdir, "nowplaying.json")),
+            "state_socket = {}".format(path.join(workdir, "nowplaying.sock")),
+            "providers =",
+            "notify_backend = recording",
+            "",
+        ]))
+
+    lookups = {"popup": [0, 0], "prefetch": [0, 0]}
+    local = threading.local()
+    outcome = {}
+
+    class BenchWatcher(mpnotd.MPDWatcher):
+
+        def warm_song(self, song):
+            local.path = "prefetch"
+            try:
+                super().warm_song(song)
+            finally:
+                local.path = "popup"
+
+    class BenchNotify(mpnotd.MPDNotify):
+
+        # Nothing from the user's home, their plugins included
+        paths = dict(mpnotd.APP_DIRS, cache=cachedir, config=configdir,
+                     plugins=path.join(workdir, "plugins"))
+        watcher_class = BenchWatcher
+
+        async def run(self):
+            import asyncio
+
+            # Count index hits, split by who asked
+            lookup = self.index.lookup
+
+            def counted(*key):
+                found, thumb = lookup(*key)
+                stat = lookups[getattr(local, "path", "popup")]
+                stat[0 if found else 1] += 1
+                return found, thumb
+
+            self.index.lookup = counted
+
+            daemon = asyncio.ensure_future(super().run())
+            loop = asyncio.get_running_loop()
+            outcome["events"] = await loop.run_in_executor(
+                None, results.get, True, 3600)
+
+            daemon.cancel()
+            for task in list(self.tasks):
+                task.cancel()
+            for watcher in self.watchers:
+                watcher.prefetcher.stop()
+                watcher.client.disconnect()
+
+    sys.argv = ["mpnotd"]
+
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    notify = BenchNotify()
+    usage_end = resource.getrusage(resource.RUSAGE_SELF)
+
+    notify.cache.save()
+    notify.index.close()
+    server.terminate()
+
+    result = summarize(outcome["events"], notify.notifier.backend.records,
+                       float(args.debounce))
+    result.update({
+        "scenario": args.scenario,
+        "albums": args.albums,
+        "popup_hit_rate": _rate(lookups["popup"]),
+        "prefetch_hit_rate": _rate(lookups["prefetch"]),
+        "cpu_s": round((usage_end.ru_utime - usage.ru_utime) +
+                       (usage_end.ru_stime - usage.ru_stime), 3),
+        "maxrss_mb": round(usage_end.ru_maxrss / 1024.0, 1),
+    })
+
+    return result
+
+
+def _rate(stat):
+    total = stat[0] + stat[1]
+    return round(stat[0] / float(total), 3) if total else None
+
+
+def summarize(events, records, debounce):
+    """ Match recorded MPD events with the popups they caused
+    """
+
+    shows = [rec for rec in records if rec[1] == "show"]
+    updates = [rec for rec in records if rec[1] == "update" and rec[4]]
+
+    songs = [event for event in events if event[1] == "song"]
+    final = []
+    skipped = set()
+
+    # A song replaced within the quiet window should never show
+    for num, event in enumerate(songs):
+        after = songs[num + 1] if num + 1 < len(songs) else None
+        if after is not None and after[0] - event[0] < debounce:
+            skipped.add(event[2])
+        else:
+            final.append(event)
+
+    popup, art, other, missed = [], [], [], 0
+
+    for wake, title in [(event[0], event[2]) for event in final]:
+        show = _first(shows, wake, "<b>{}</b>".format(title))
+        if show is None:
+            missed += 1
+            continue
+
+        popup.append(show[0] - wake)
+
+        update = next((rec for rec in updates if rec[2] == show[2]), None)
+        if update is not None:
+            art.append(update[0] - wake)
+
+    expect = {
+        ("output", None): "Output ",
+        ("update", "start"): "Updating database",
+        ("update", "done"): "Database updated",
+    }
+
+    for wake, kind, detail in events:
+        text = expect.get((kind, None if kind == "output" else detail))
+        if text is None:
+            continue
+
+        show = _first(shows, wake, text)
+        if show is None:
+            missed += 1
+        else:
+            other.append(show[0] - wake)
+
+    superseded = sum(
+        1 for rec in shows if rec[3] and any(
+            "<b>{}</b>".format(title) in rec[3] for title in skipped))
+
+    def msec(values, pct):
+        value = percentile(values, pct)
+        return None if value is None else round(value * 1000, 1)
+
+    return {
+        "events": len(events),
+        "popups": len(shows),
+        "missed": missed,
+        "superseded": superseded,
+        "song_p50_ms": msec(popup, 50),
+        "song_p99_ms": msec(popup, 99),
+        "art_p50_ms": msec(art, 50),
+        "art_p99_ms": msec(art, 99),
+        "other_p50_ms": msec(other, 50),
+        "other_p99_ms": msec(other, 99),
+    }
+
+
+def _first(shows, wake, text):
+    return next((rec for rec in shows
+                 if rec[0] >= wake and rec[3] and text in rec[3]), None)
+
+
+def print_table(results):
+    """ Print results as a plain text table
+    """
+
+    columns = ["scenario", "events", "popups", "missed", "superseded",
+               "song_p50_ms", "song_p99_ms", "art_p50_ms", "art_p99_ms",
+               "other_p50_ms", "other_p99_ms", "popup_hit_rate",
+               "prefetch_hit_rate", "cpu_s", "maxrss_mb"]
+
+    rows = [[str(result.get(col, "")) for col in columns]
+            for result in results]
+    widths = [max(len(col), *(len(row[num]) for row in rows))
+              for num, col in enumerate(columns)]
+
+    for row in [columns] + rows:
+        print("  ".join(cell.rjust(width)
+                        for cell, width in zip(row, widths)))
+
+
+def read_args():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--scenario", choices=SCENARIOS, action="append",
+                        help="scenario to run, repeatable (default all)")
+    parser.add_argument("--albums", type=int, default=50,
+                        help="albums in the synthetic library")
+    parser.add_argument("--tracks", type=int, default=10,
+                        help="tracks per album")
+    parser.add_argument("--cover-size", type=int, default=1500,
+                        help="cover.jpg size in pixels")
+    parser.add_argument("--mpd-art", action="store_true",
+                        help="serve covers over albumart, not the music dir")
+    parser.add_argument("--cache-entries", type=int, default=1000,
+                        help="unrelated thumbnails already in the cache")
+    parser.add_argument("--count", type=int, default=40,
+                        help="events per scenario")
+    parser.add_argument("--interval", type=float, default=0.5,
+                        help="seconds between events")
+    parser.add_argument("--debounce", type=float, default=0.3)
+    parser.add_argument("--prefetch", type=int, default=3)
+    parser.add_argument("--popup-interval", type=float, default=1,
+                        help="min seconds between non-song popups")
+    parser.add_argument("--json", action="store_true",
+                        help="print results as JSON lines")
+    parser.add_argument("--child", action="store_true",
+                        help=argparse.SUPPRESS)
+
+    return parser.parse_args()
+
+
+def main():
+    args = read_args()
+
+    if args.child:
+        args.scenario = args.scenario[0]
+        print(json.dumps(run_scenario(args)))
+        return
+
+    results = []
+
+    options = []
+
+    for name, value in sorted(vars(args).items()):
+        flag = "--{}".format(name.replace("_", "-"))
+
+        if name in ("scenario", "json", "child") or value is False:
+            continue
+
+        options.append(flag if value is True else "{}={}".format(
+            flag, value))
+
+    for scenario in args.scenario or SCENARIOS:
+        output = subprocess.run(
+            [sys.executable, __file__, "--child", "--scenario", scenario] +
+            options,
+            check=True,
+            stdout=subprocess.PIPE).stdout
+        results.append(json.loads(output.decode().strip().splitlines()[-1]))
+
+    if args.json:
+        for result in results:
+            print(json.dumps(result))
+    else:
+        print_table(results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,213 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+""" Startup time benchmark
+
+Measures, each in a fresh interpreter:
+
+    import mpnotd
+    mpnotd --writeini (parse args, write config, quit)
+    launch to the first idle command on a stand-in MPD server
+
+and checks that heavy optional modules (NumPy, Pillow, http.client,
+notify2) are not imported at startup. Exits non-zero if a check fails
+or a median exceeds its limit, so it can guard against regressions.
+
+    python benchmarks/bench_startup.py
+    python benchmarks/bench_startup.py --runs 20 --max-idle-ms 500
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from os import path
+
+ROOT = path.dirname(path.dirname(path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import fakempd  # noqa: E402
+
+# Must stay out of a default startup
+LAZY_MODULES = ["numpy", "PIL", "http.client", "notify2",
+                "multiprocessing.pool", "mpnotd.cavacolor", "mpnotd.providers",
+                "mpnotd.warm"]
+
+# Starts the daemon, `home` holds config and cache
+DAEMON = "import mpnotd; mpnotd.MPDNotify()"
+
+
+def child_env(home):
+    env = dict(os.environ, HOME=home)
+    env["PYTHONPATH"] = os.pathsep.join(
+        [ROOT] + [p for p in [os.environ.get("PYTHONPATH")] if p])
+    return env
+
+
+def make_home(port):
+    """ Return temp HOME with a config pointing at `port`
+    """
+
+    home = tempfile.mkdtemp(prefix="mpnotd-startup-")
+    configdir = path.join(home, ".config", "mpnotd")
+    os.makedirs(configdir)
+
+    with open(path.join(configdir, "config"), "w") as config:
+        config.write("\n".join([
+            "[mpnotd]",
+            "host = 127.0.0.1",
+            "port = {}".format(port),
+            "music = {}".format(path.join(home, "music")),
+            "",
+        ]))
+
+    return home
+
+
+def time_command(args, env, runs):
+    """ Return wall times in ms of running `args` to completion
+    """
+
+    times = []
+
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run(args, env=env, check=True, stdout=subprocess.DEVNULL)
+        times.append((time.perf_counter() - start) * 1000)
+
+    return times
+
+
+def time_to_idle(runs):
+    """ Return ms from launch until the daemon idles on MPD
+    """
+
+    ctx = multiprocessing.get_context("spawn")
+    times = []
+
+    for _ in range(runs):
+        ready, results = ctx.Queue(), ctx.Queue()
+        server = ctx.Process(target=fakempd.run,
+                             args=(fakempd.make_library(4, 2), [], ready,
+                                   results, 0),
+                             daemon=True)
+        server.start()
+        home = make_home(ready.get(timeout=30))
+
+        start = time.perf_counter()
+        daemon = subprocess.Popen([sys.executable, "-c", DAEMON],
+                                  env=child_env(home))
+
+        try:
+            # Sent once the daemon sent its first idle
+            results.get(timeout=60)
+            times.append((time.perf_counter() - start) * 1000)
+        finally:
+            daemon.terminate()
+            daemon.wait()
+            server.terminate()
+            shutil.rmtree(home, ignore_errors=True)
+
+    return times
+
+
+def lazy_imports(env):
+    """ Return heavy modules loaded by a default startup
+    """
+
+    code = ("import sys, mpnotd\n"
+            "print(' '.join(name for name in {!r} if name in sys.modules))"
+            .format(LAZY_MODULES))
+
+    output = subprocess.run([sys.executable, "-c", code], env=env, check=True,
+                            stdout=subprocess.PIPE).stdout
+
+    return output.decode().split()
+
+
+def read_args():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--runs", type=int, default=10,
+                        help="fresh interpreters per measurement")
+    parser.add_argument("--max-import-ms", type=float, default=None,
+                        help="fail if median import time is higher")
+    parser.add_argument("--max-writeini-ms", type=float, default=None,
+                        help="fail if median --writeini time is higher")
+    parser.add_argument("--max-idle-ms", type=float, default=None,
+                        help="fail if median time to first idle is higher")
+    parser.add_argument("--json", action="store_true",
+                        help="print results as JSON")
+
+    return parser.parse_args()
+
+
+def main():
+    args = read_args()
+
+    home = make_home(6600)
+    env = child_env(home)
+
+    try:
+        # Warm the page cache and bytecode before timing
+        time_command([sys.executable, "-c", "import mpnotd"], env, 1)
+
+        results = {
+            "import": time_command([sys.executable, "-c", "import mpnotd"],
+                                   env, args.runs),
+            "writeini": time_command(
+                [sys.executable, "-c", DAEMON, "--writeini"], env, args.runs),
+            "idle": time_to_idle(args.runs),
+        }
+
+        eager = lazy_imports(env)
+    finally:
+        shutil.rmtree(home, ignore_errors=True)
+
+    limits = {
+        "import": args.max_import_ms,
+        "writeini": args.max_writeini_ms,
+        "idle": args.max_idle_ms,
+    }
+
+    report = {}
+    failed = []
+
+    for name, times in results.items():
+        median = statistics.median(times)
+        report[name] = {
+            "median_ms": round(median, 1),
+            "min_ms": round(min(times), 1),
+            "max_ms": round(max(times), 1),
+        }
+
+        if limits[name] is not None and median > limits[name]:
+            failed.append("{} median {:.1f}ms > {:.1f}ms".format(
+                name, median, limits[name]))
+
+    report["eager_imports"] = eager
+
+    if eager:
+        failed.append("imported at startup: {}".format(", ".join(eager)))
+
+    if args.json:
+        print(json.dumps(report))
+    else:
+        for name in results:
+            print("{:>10}  median {median_ms:>7} ms  min {min_ms:>7} ms  "
+                  "max {max_ms:>7} ms".format(name, **report[name]))
+        print("{:>10}  {}".format("eager", ", ".join(eager) or "none"))
+
+    for failure in failed:
+        print("FAIL: {}".format(failure), file=sys.stderr)
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
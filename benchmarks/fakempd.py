@@ -0,0 +1,457 @@
+# -*- coding: utf-8 -*-
+
+""" Stand-in MPD server replaying scripted traces
+
+Speaks enough of the MPD protocol for mpnotd: idle/noidle, status,
+currentsong, the queue commands, outputs, lsinfo and the artwork
+commands, albumart and readpicture answering in binarylimit sized
+chunks.
+A trace is a list of (delay, action) tuples run once a client idles
+on the player subsystem. Every action records the time its idle
+event went out, so the harness can match it with the popup it caused.
+"""
+
+import asyncio
+import shlex
+import time
+
+PROTOCOL = "0.23.5"
+
+
+def make_library(albums, tracks=10):
+    """ Return list of song dicts for a synthetic library
+
+    Songs live in `Artist NNN/Album NNN/`, matching make_music_dir()
+    """
+
+    songs = []
+
+    for num in range(albums):
+        artist = "Artist {:03d}".format(num % max(albums // 4, 1))
+        album = "Album {:03d}".format(num)
+
+        for track in range(1, tracks + 1):
+            songs.append({
+                "file": "{}/{}/{:02d} - Title.flac".format(
+                    artist, album, track),
+                "Artist": artist,
+                "Album": album,
+                "Title": "Title {:03d}-{:02d}".format(num, track),
+                "Track": str(track),
+                "Time": "200",
+                "duration": "200.000",
+            })
+
+    return songs
+
+
+def make_trace(scenario, count=40, interval=0.5):
+    """ Return (delay, action) list for a named scenario
+
+    Scenarios:
+        track_changes: play through `count` songs
+        skip_storm: bursts of five quick skips
+        output_toggle: toggle the first output
+        db_update: database update start and finish
+        mixed: all of the above interleaved
+    """
+
+    trace = [(0, "play")]
+
+    if scenario == "track_changes":
+        trace += [(interval, "next")] * count
+
+    elif scenario == "skip_storm":
+        for _ in range(count // 5):
+            trace += [(0.05, "next")] * 5
+            trace.append((interval * 2, "noop"))
+
+    elif scenario == "output_toggle":
+        trace += [(interval, "toggle_output")] * count
+
+    elif scenario == "db_update":
+        trace += [(interval * 2, "update")] * (count // 2)
+
+    elif scenario == "mixed":
+        for num in range(count):
+            trace.append((interval, "next"))
+            if num % 5 == 4:
+                trace += [(0.05, "next")] * 4
+            if num % 7 == 6:
+                trace.append((interval, "toggle_output"))
+            if num % 11 == 10:
+                trace.append((interval, "update"))
+
+    else:
+        raise ValueError("Unknown scenario: {}".format(scenario))
+
+    return trace + [(interval * 4, "noop")]
+
+
+class FakeMPD:
+
+    def __init__(self, songs, trace, outputs=("Pulse", "HTTP stream"),
+                 covers=None, pictures=None):
+
+        """ FakeMPD
+
+        Args:
+            songs (list): Queue of song dicts, see make_library()
+            trace (list): (delay, action) tuples, see make_trace()
+            outputs (list): Output names
+            covers (dict): Album dir to image bytes, for albumart
+            pictures (dict): Song file to image bytes, for readpicture
+
+        """
+
+        self.songs = [dict(song, Pos=str(pos), Id=str(pos + 1))
+                      for pos, song in enumerate(songs)]
+        self.trace = trace
+        self.covers = covers or {}
+        self.pictures = pictures or {}
+
+        # Bytes per binary chunk, MPD's default. Shared by all clients,
+        # enough for a stand-in
+        self.binarylimit = 8192
+
+        self.outputs = [{
+            "outputid": str(num),
+            "outputname": name,
+            "plugin": "pulse",
+            "outputenabled": "1",
+        } for num, name in enumerate(outputs)]
+
+        self.state = "stop"
+        self.pos = 0
+        self.version = 1
+        self.updating = 0
+        self.job = 0
+
+        self.clients = set()
+        self.player_idle = asyncio.Event()
+        self.events = []
+        self.done = asyncio.Event()
+
+    # Trace replay
+
+    async def replay(self, settle=1.0):
+
+        """ Run trace once a client watches the player
+        """
+
+        await self.player_idle.wait()
+        await asyncio.sleep(settle)
+
+        for delay, action in self.trace:
+            await asyncio.sleep(delay)
+            getattr(self, "do_" + action)()
+
+        self.done.set()
+
+    def record(self, kind, detail):
+        self.events.append((time.monotonic(), kind, detail))
+
+    def do_noop(self):
+        pass
+
+    def do_play(self):
+        self.state = "play"
+        self.record("song", self.songs[self.pos]["Title"])
+        self.notify("player")
+
+    def do_next(self):
+        self.pos = (self.pos + 1) % len(self.songs)
+        self.record("song", self.songs[self.pos]["Title"])
+        self.notify("player")
+
+    def do_toggle_output(self):
+        output = self.outputs[0]
+        output["outputenabled"] = "0" if output[
+            "outputenabled"] == "1" else "1"
+        self.record("output", output["outputname"])
+        self.notify("output")
+
+    def do_update(self):
+        self.job += 1
+        self.updating = self.job
+        self.record("update", "start")
+        self.notify("update")
+        asyncio.get_running_loop().call_later(0.2, self._update_done)
+
+    def _update_done(self):
+        self.updating = 0
+        self.record("update", "done")
+        self.notify("update", "database")
+
+    def notify(self, *subsystems):
+        for client in self.clients:
+            client.changed(subsystems)
+
+    # Command handlers, return list of (key, value) or raise CommandError
+
+    def cmd_status(self):
+        song = self.songs[self.pos]
+        nextpos = (self.pos + 1) % len(self.songs)
+
+        status = [
+            ("volume", "80"),
+            ("repeat", "1"),
+            ("random", "0"),
+            ("single", "0"),
+            ("consume", "0"),
+            ("playlist", str(self.version)),
+            ("playlistlength", str(len(self.songs))),
+            ("state", self.state),
+        ]
+
+        if self.state != "stop":
+            status += [
+                ("song", song["Pos"]),
+                ("songid", song["Id"]),
+                ("nextsong", self.songs[nextpos]["Pos"]),
+                ("nextsongid", self.songs[nextpos]["Id"]),
+                ("elapsed", "1.000"),
+                ("bitrate", "900"),
+                ("audio", "44100:16:2"),
+            ]
+
+        if self.updating:
+            status.append(("updating_db", str(self.updating)))
+
+        return status
+
+    def cmd_currentsong(self):
+        if self.state == "stop":
+            return []
+        return list(self.songs[self.pos].items())
+
+    def cmd_playlistid(self, songid=None):
+        if songid is None:
+            return self._songs(self.songs)
+        for song in self.songs:
+            if song["Id"] == songid:
+                return list(song.items())
+        raise CommandError(50, "No such song")
+
+    def cmd_playlistinfo(self, window=None):
+        if window is None:
+            return self._songs(self.songs)
+        if ":" in window:
+            start, end = window.split(":")
+            return self._songs(self.songs[int(start):int(end or 0) or None])
+        return list(self.songs[int(window)].items())
+
+    def cmd_plchanges(self, version, window=None):
+        return self._songs(self.songs) if int(version) < self.version else []
+
+    def cmd_plchangesposid(self, version, window=None):
+        if int(version) >= self.version:
+            return []
+        return [(key, song[name]) for song in self.songs
+                for key, name in (("cpos", "Pos"), ("Id", "Id"))]
+
+    def cmd_outputs(self):
+        return [(key, value) for output in self.outputs
+                for key, value in output.items()]
+
+    def cmd_lsinfo(self, uri=""):
+        prefix = uri.strip("/") + "/" if uri.strip("/") else ""
+        dirs, songs = [], []
+
+        for song in self.songs:
+            if not song["file"].startswith(prefix):
+                continue
+
+            name = song["file"][len(prefix):]
+
+            if "/" not in name:
+                songs.append({key: value for key, value in song.items()
+                              if key not in ("Pos", "Id")})
+            elif prefix + name.split("/")[0] not in dirs:
+                dirs.append(prefix + name.split("/")[0])
+
+        return [("directory", name) for name in dirs] + self._songs(songs)
+
+    def cmd_list(self, tag, *args):
+        seen = []
+        for song in self.songs:
+            pair = (song["Artist"], song["Album"])
+            if pair not in seen:
+                seen.append(pair)
+        return [item for artist, album in seen
+                for item in (("AlbumArtist", artist), ("Album", album))]
+
+    def cmd_albumart(self, uri, offset):
+        data = self.covers.get(uri.rpartition("/")[0])
+        if data is None:
+            raise CommandError(50, "No file exists")
+        return self._binary(data, offset)
+
+    def cmd_readpicture(self, uri, offset):
+        data = self.pictures.get(uri)
+        if data is None:
+            return []
+        return self._binary(data, offset)
+
+    def cmd_binarylimit(self, size):
+        self.binarylimit = max(int(size), 64)
+        return []
+
+    def cmd_ping(self):
+        return []
+
+    cmd_password = lambda self, *args: []
+
+    def _binary(self, data, offset):
+        offset = int(offset)
+        if offset > len(data):
+            raise CommandError(2, "Offset too large")
+        return [
+            ("size", len(data)),
+            ("type", "image/jpeg"),
+            ("binary", data[offset:offset + self.binarylimit]),
+        ]
+
+    @staticmethod
+    def _songs(songs):
+        return [item for song in songs for item in song.items()]
+
+    # Server
+
+    async def serve(self, host="127.0.0.1", port=0):
+
+        """ Start listening, return bound port
+        """
+
+        self.server = await asyncio.start_server(self._connection, host, port)
+        return self.server.sockets[0].getsockname()[1]
+
+    async def _connection(self, reader, writer):
+        client = Client(self, writer)
+        self.clients.add(client)
+        writer.write("OK MPD {}\n".format(PROTOCOL).encode())
+
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                if not client.handle(line.decode("utf-8").rstrip("\n")):
+                    break
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            self.clients.discard(client)
+            writer.close()
+
+
+class CommandError(Exception):
+
+    def __init__(self, code, message):
+        super().__init__(message)
+        self.code = code
+
+
+class Client:
+
+    def __init__(self, server, writer):
+        self.server = server
+        self.writer = writer
+        self.idling = None
+        self.pending = set()
+
+    def changed(self, subsystems):
+        self.pending.update(subsystems)
+        self._wake()
+
+    def _wake(self, force=False):
+        if self.idling is None:
+            return
+
+        ready = [name for name in sorted(self.pending)
+                 if not self.idling or name in self.idling]
+
+        if ready or force:
+            self.pending.difference_update(ready)
+            self.idling = None
+            self._send([("changed", name) for name in ready])
+
+    def handle(self, line):
+
+        """ Run one command line, return False to close
+        """
+
+        args = shlex.split(line)
+        command, args = args[0], args[1:]
+
+        if command == "idle":
+            self.idling = set(args)
+            if "player" in self.idling or not self.idling:
+                self.server.player_idle.set()
+            self._wake()
+            return True
+
+        if command == "noidle":
+            self._wake(force=True)
+            return True
+
+        if command == "close":
+            return False
+
+        handler = getattr(self.server, "cmd_" + command, None)
+
+        if handler is None:
+            self._ack(5, command, "unknown command \"{}\"".format(command))
+            return True
+
+        try:
+            self._send(handler(*args))
+        except CommandError as cmd_err:
+            self._ack(cmd_err.code, command, str(cmd_err))
+        except TypeError:
+            self._ack(2, command, "wrong number of arguments")
+
+        return True
+
+    def _send(self, pairs):
+        response = bytearray()
+
+        for key, value in pairs:
+            if isinstance(value, bytes):
+                # binary: <length>, the raw bytes and a newline
+                response += "{}: {}\n".format(key, len(value)).encode()
+                response += value + b"\n"
+            else:
+                response += "{}: {}\n".format(key, value).encode("utf-8")
+
+        self.writer.write(bytes(response) + b"OK\n")
+
+    def _ack(self, code, command, message):
+        self.writer.write("ACK [{}@0] {{{}}} {}\n".format(
+            code, command, message).encode("utf-8"))
+
+
+def run(songs, trace, ready, results, settle=1.0, covers=None):
+    """ Serve until `trace` is replayed, entry point for a subprocess
+
+    Args:
+        songs (list): Queue of song dicts
+        trace (list): (delay, action) tuples
+        ready (obj): Queue receiving the bound port
+        results (obj): Queue receiving recorded events when done
+        settle (float): Seconds between first player idle and trace
+        covers (dict): Album dir to image bytes, served by albumart
+
+    """
+
+    async def main():
+        fake = FakeMPD(songs, trace, covers=covers)
+        ready.put(await fake.serve())
+        await fake.replay(settle)
+        results.put(fake.events)
+
+        # Keep answering until the harness has shut mpnotd down
+        await asyncio.sleep(3600)
+
+    asyncio.run(main())
@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+
+""" Example mpnotd plugin, copy to ~/.config/mpnotd/plugins
+
+Writes the current song to a file for status bars and appends
+played songs to a local scrobble queue
+"""
+
+import time
+from os import path
+
+NOWPLAYING = path.expanduser("~/.cache/mpnotd/nowplaying")
+SCROBBLES = path.expanduser("~/.cache/mpnotd/scrobbles.tsv")
+
+
+def on_song(event):
+    song = event["song"]
+
+    with open(NOWPLAYING, "w") as out:
+        out.write("{} - {}\n".format(song["artist"], song["title"]))
+
+    with open(SCROBBLES, "a") as out:
+        out.write("{}\t{}\t{}\t{}\n".format(int(time.time()), song["artist"],
+                                            song["album"], song["title"]))
+
+
+def on_state(event):
+    if event["state"] != "play":
+        with open(NOWPLAYING, "w") as out:
+            out.write("\n")
@@ -4,16 +4,29 @@
 
 # MPDNotify - MPD Notification Daemon
 
+import asyncio
 import sys
+import threading
+import time
+from concurrent.futures import TimeoutError as FutureTimeout
+from functools import partial
 from os import path
 
-import notify2
-
-from .artwork import cache_artwork
-from .cavacolor import CavaColor
-from .client import (auth_client, get_client, get_currentsong, get_nextsong,
-                     quit_client)
-from .utils import (clean_cache, get_logger, load_config, read_args,
+from mpd import MPDError
+
+from .artwork import artwork_colors, cache_artwork
+from .cache import CacheManager
+from .client import (MPDConnection, get_artwork, get_currentsong,
+                     get_songinfo)
+from .index import ArtworkIndex
+from .metrics import METRICS
+from .notifier import (Notifier, Notify2Backend, NullBackend,
+                       RecordingBackend)
+from .nowplaying import NowPlaying, print_now
+from .playlist import QueueMirror
+from .prefetch import Prefetcher
+from .status import PopupLimiter, StatusTracker
+from .utils import (get_logger, load_config, load_servers, read_args,
                     write_config)
 
 APP_NAME = "mpnotd"
@@ -27,6 +40,18 @@ APP_DIRS = {
 
 DEBUG = False
 
+# MPD subsystems watched
+SUBSYSTEMS = ["player", "mixer", "options", "playlist", "update", "output"]
+
+# Playback option fields in status
+OPTIONS = ("repeat", "random", "single", "consume")
+
+# Max seconds between restarts of a failed server watch
+WATCH_BACKOFF = 60
+
+# Status fields in the now playing state
+STATE_FIELDS = ("state", "volume", "updating_db") + OPTIONS
+
 # Default configuration
 DEFAULTS = {
     # Host name of MPD server
@@ -37,15 +62,568 @@ DEFAULTS = {
     "auth": "",
     # Notification timeout in seconds
     "timeout": 10,
+    # Popups via notify2 (D-Bus), null drops them, recording keeps a
+    # list of them for benchmarks
+    "notify_backend": "notify2",
     # Path to music folder
     "music": "~/Music/",
     # CAVA color 0 no, 1 yes, 2 custom
     "cava": 0,
     # list of hex colors for cava 2, comma separated
     "cava_colors": "#ff0000,#00ff00,#0000ff",
+    # Seconds of quiet before handling player changes
+    "debounce": 0.3,
+    # Number of upcoming songs to prefetch artwork for, 0 disables
+    "prefetch": 3,
+    # Artwork cache budget in MiB
+    "cache_size": 64,
+    # Max number of cached thumbnails
+    "cache_entries": 10000,
+    # Hours to keep unused thumbnails, 0 forever
+    "cache_age": 100,
+    # Thumbnail sizes, comma separated, first is used for popups
+    "thumb_sizes": "96,256,512",
+    # Thumbnail format, png, jpeg or webp
+    "thumb_format": "jpeg",
+    # Ask MPD for cover files and embedded art 0 no, 1 yes
+    "mpd_art": 1,
+    # Prometheus text file for stage timings and counters, blank disables
+    "metrics": "",
+    # Web artwork providers in order, musicbrainz or URL templates with
+    # {artist} and {album}, comma separated, blank disables
+    "providers": "musicbrainz",
+    # Seconds a web artwork request may take
+    "http_timeout": 5,
+    # Number of web artwork requests at once
+    "http_workers": 2,
+    # Hours before albums without artwork are searched again
+    "miss_ttl": 24,
+    # Forget artwork when album dir images change 0 no, 1 inotify,
+    # 2 polling
+    "watch": 1,
+    # Seconds between polls of album dirs inotify can not watch
+    "watch_interval": 300,
+    # Min seconds between volume, option, output and update popups
+    "popup_interval": 1,
+    # Number of threads running plugin hooks, 0 disables plugins
+    "plugin_workers": 2,
+    # Seconds a plugin hook may take before it is given up on
+    "plugin_timeout": 5,
+    # JSON file with what is playing, for status bars, blank disables
+    "state_file": "~/.cache/mpnotd/nowplaying.json",
+    # Unix socket pushing the same JSON on every change, blank disables
+    "state_socket": "~/.cache/mpnotd/nowplaying.sock",
 }
 
 
+class MPDWatcher:
+
+    def __init__(self, daemon, label, config):
+        """ Watch one MPD server
+
+        Artwork index, thumbnail cache, CAVA and tasks are shared
+        through `daemon`, connections and player state are per server
+
+        Args:
+            daemon (obj): The MPDNotify instance
+            label (str): Server name shown in popups
+            config (dict): Config with this server's overrides
+
+        """
+
+        self.daemon = daemon
+        self.label = label
+        self.config = config
+        self.log = daemon.log
+        self.icon = daemon.icon
+
+        # Song popups name the server once there is more than one
+        self.playing = "Playing..." if len(
+            daemon.servers) < 2 else "Playing on {}...".format(label)
+
+        self.client = None
+        self.player_task = None
+        self.song_task = None
+        self.prefetcher = None
+
+        # Last status and outputs, diffed on every wake
+        self.tracker = StatusTracker()
+
+        # Status the last player popup was based on
+        self._status = {}
+
+        # Mixer, options, output and update popups, coalesced
+        self.popups = PopupLimiter(self.popup, config["popup_interval"])
+
+        # Queue kept in memory, updated from playlist deltas
+        self.queue = QueueMirror(self.log)
+
+    async def run(self):
+        """ Open MPD connection and watch for events
+
+        An error ends only this server's watch, it is logged and the
+        watch started again with backoff while other servers go on
+        """
+
+        # Idle and command connections, reopened if they drop
+        self.client = MPDConnection(self.config, self.log, self.resync)
+
+        # Warm artwork for upcoming songs in the background
+        self.prefetcher = Prefetcher(self.warm_song, self.log,
+                                     self.config["prefetch"])
+
+        delay = 1
+
+        while True:
+            started = time.monotonic()
+
+            try:
+                await self.client.connect()
+                self.prefetcher.start()
+                await self.mpd_events()
+            except Exception:
+                METRICS.count("watch_error")
+                self.log.exception("Watching {} failed, retry in {}s".format(
+                    self.label, delay))
+            finally:
+                self.prefetcher.stop()
+                self.client.disconnect()
+
+            # A watch that ran for a while starts over with a short wait
+            if time.monotonic() - started > WATCH_BACKOFF:
+                delay = 1
+
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, WATCH_BACKOFF)
+
+            # Playlist versions may have moved on or restarted
+            self.queue.reset()
+
+    async def mpd_events(self):
+        """ Display notifications for changes to MPD subsystems
+
+        The idle watch never waits on artwork, color or notification
+        work, those run as tasks in the background
+        """
+
+        # Get initial status and outputs
+        self._status = await self.client.status()
+        self.tracker.update(self._status)
+        self.tracker.update_outputs(await self.client.outputs())
+
+        # Publish what is playing before the first change
+        self.export(outputs=self.output_list(),
+                    **self.status_fields(self._status))
+
+        if self._status.get("state") in ("play", "pause"):
+            current = await get_currentsong(self.client)
+            self.export(song=current)
+
+            if all(key in current for key in ("artist", "album")):
+                self.daemon.spawn(self.export_artwork(current))
+
+        # Watch MPDClient.idle for changes
+        async for subsystems in self.client.idle(SUBSYSTEMS):
+            with METRICS.timer("idle_wake"):
+                await self.subsystems_changed(subsystems)
+
+    async def subsystems_changed(self, subsystems):
+        """ Dispatch one idle wake
+
+        Status is queried once per wake and diffed against the last
+        one, handlers only run for fields that changed. Outputs are
+        only queried when they changed.
+
+        Args:
+            subsystems (list): Changed subsystem names
+
+        """
+
+        self.log.debug("Subsys: {}".format(", ".join(subsystems)))
+
+        with METRICS.timer("status"):
+            status = await self.client.status()
+
+        changes = self.tracker.update(status)
+
+        if "output" in subsystems:
+            for change in self.tracker.update_outputs(
+                    await self.client.outputs()):
+                self.output_changed(*change)
+
+        # Player state changed, restart the quiet window so a
+        # burst of skips is handled once for the last song
+        if "state" in changes or "songid" in changes:
+            self.schedule_player()
+
+        # Queue changed, fetch only what changed since last time
+        if "playlist" in changes:
+            self.daemon.spawn(self.queue.sync(self.client, status))
+
+            if "playlistlength" in changes:
+                self.log.debug("Queue: {} songs".format(
+                    status.get("playlistlength", 0)))
+
+        if "volume" in changes:
+            self.volume_changed(*changes["volume"])
+
+        options = [field for field in OPTIONS if field in changes]
+        if options:
+            self.options_changed(status, options)
+
+        if "audio" in changes or "bitrate" in changes:
+            self.log.debug("Audio: {} {}kbps".format(
+                status.get("audio", "-"), status.get("bitrate", "-")))
+
+        if "update" in subsystems:
+            self.update_changed(*changes.get("updating_db", (None, None)))
+
+        if any(field in changes for field in STATE_FIELDS) or (
+                "output" in subsystems):
+            self.export(outputs=self.output_list(),
+                        **self.status_fields(status))
+
+    def export(self, **fields):
+        """ Publish `fields` of this server's now playing state
+        """
+
+        if self.daemon.nowplaying is not None:
+            self.daemon.nowplaying.update(self.label, **fields)
+
+    def status_fields(self, status):
+        """ Return exported fields of `status`
+        """
+
+        fields = {field: status.get(field) for field in STATE_FIELDS}
+        fields["updating_db"] = "updating_db" in status
+
+        return fields
+
+    def output_list(self):
+        """ Return outputs for export, ordered by id
+        """
+
+        return [{
+            "id": int(outputid),
+            "name": output["outputname"],
+            "enabled": output["outputenabled"] == "1",
+        } for outputid, output in sorted(self.tracker.outputs.items(),
+                                          key=lambda item: int(item[0]))]
+
+    def schedule_player(self):
+        """ (Re)start player_changed() after the quiet window
+        """
+
+        if self.player_task is not None:
+            self.player_task.cancel()
+
+        self.player_task = self.daemon.spawn(self.player_changed())
+
+    def volume_changed(self, old, new):
+        """ Show volume, missing or -1 without a mixer
+        """
+
+        if new is None or int(new) < 0:
+            return
+
+        self.popups.submit("volume", category="mixer",
+                           message="Volume {}%".format(new),
+                           icon="audio-volume-{}".format(
+                               "muted" if new == "0" else "high"))
+
+    def options_changed(self, status, fields):
+        """ Show playback options, naming the ones that changed
+        """
+
+        message = ", ".join(
+            "<b>{}</b> {}".format(
+                field.capitalize(),
+                "oneshot" if status.get(field) == "oneshot"
+                else "on" if status.get(field) == "1" else "off")
+            for field in fields)
+
+        self.popups.submit("options", category="options", message=message,
+                           icon="dialog-info")
+        self.log.debug("Options: {}".format(message))
+
+    def update_changed(self, old, new):
+        """ Show database update start and end
+
+        A quick update can be over before status is read, the
+        update wake alone then means it is done
+        """
+
+        if new is not None and old is None:
+            key = "update:start"
+            message = "Updating database..."
+            icon = "content-loading"
+        elif new is None:
+            key = "update:done"
+            message = "Database updated!"
+            icon = "checkbox-checked"
+        else:
+            return
+
+        self.daemon.emit("on_update", server=self.label,
+                         updating=key == "update:start")
+
+        self.popups.submit(key, category="database", message=message,
+                           icon=icon)
+        self.log.debug(message)
+
+    def output_changed(self, outputid, old, new):
+        """ Show outputs being added, removed, enabled or disabled
+        """
+
+        if new is None:
+            message = "Output {} removed".format(old["outputname"])
+            icon = "dialog-info"
+        elif old is not None and (old["outputenabled"]
+                                  == new["outputenabled"]):
+            return
+        elif new["outputenabled"] == "1":
+            message = "Output {} enabled".format(new["outputname"])
+            icon = "dialog-info"
+        else:
+            message = "Output {} disabled!".format(new["outputname"])
+            icon = "dialog-error"
+
+        self.daemon.emit("on_output", server=self.label, output=new,
+                         previous=old)
+
+        self.popups.submit("output:{}".format(outputid), category="outputs",
+                           message=message, icon=icon)
+        self.log.debug(message)
+
+    def popup(self, category, **data):
+        """ Show a popup titled with the server label
+        """
+
+        self.notify(category, summary=self.label, **data)
+
+    def notify(self, category, **data):
+        """ Show popup `data`, replacing the last one of `category`
+
+        Returns:
+            Popup handle, its icon can be swapped in later
+
+        """
+
+        return self.daemon.notifier.show((self.label, category), **data)
+
+    async def resync(self):
+        """ Refresh saved state after the idle connection was reopened
+
+        Changes missed while disconnected are handled like a player
+        event, an unchanged song shows no popup again
+        """
+
+        status = await self.client.status()
+        changes = self.tracker.update(status)
+        self.tracker.update_outputs(await self.client.outputs())
+
+        self.log.debug("Resync: {}".format(status.get("state")))
+
+        # Playlist versions restart with MPD
+        self.queue.reset()
+
+        self.export(outputs=self.output_list(), **self.status_fields(status))
+
+        if "state" in changes or "songid" in changes:
+            self.schedule_player()
+
+    async def player_changed(self):
+        """ Handle player state once MPD has been quiet for `debounce`
+
+        Uses the status of the last wake, no query of its own
+        """
+
+        await asyncio.sleep(float(self.config["debounce"]))
+
+        data = {"summary": self.label, "icon": self.icon}
+
+        status = self.tracker.status
+        previous = self._status
+
+        # Burst ended where it started
+        if (status.get("state") == previous.get("state")
+                and status.get("songid") == previous.get("songid")):
+            return
+
+        # Save status
+        self._status = status
+
+        # Get current state
+        state = status.get("state", "")
+
+        self.log.debug("Player: {}".format(state))
+
+        if state != previous.get("state"):
+            self.daemon.emit("on_state", server=self.label, state=state,
+                             status=status)
+
+        # Player paused
+        if state == "pause":
+
+            data["message"] = "<i>Playback paused...</i>"
+
+            self.notify("player", **data)
+
+        # Player stopped
+        elif state == "stop":
+
+            data["message"] = "<i>Playback stopped...</i>"
+
+            self.notify("player", **data)
+
+        # Show current song
+        elif state == "play":
+
+            with METRICS.timer("currentsong"):
+                current = await get_currentsong(self.client)
+
+            self.export(song=current, artwork=None, color=None)
+
+            # Only show after tag data is read
+            if all(key in current for key in ("artist", "title", "album")):
+
+                # Latest wins, drop work for a song that is already gone
+                if self.song_task is not None:
+                    self.song_task.cancel()
+
+                self.song_task = self.daemon.spawn(
+                    self.song_changed(current, status))
+
+    async def song_changed(self, current, status):
+        """ Show song popup, then swap in album art when it is ready
+
+        Args:
+            current (dict): Current song
+            status (dict): Player status
+
+        """
+
+        # Repeated tags reduced to one value, as in the artwork index
+        song = get_songinfo(current)
+
+        # notifcation payload, placeholder icon until artwork resolves
+        data = {
+            "summary": self.playing,
+            "message": "<b>{}</b>\nBy <b>{}</b>\nFrom <b>{}</b>".format(
+                song["title"], song["artist"], song["album"]),
+            "icon": self.icon,
+        }
+
+        # Show Notification, replacing the last song or state popup
+        popup = self.notify("player", **data)
+
+        # cache album art
+        artwork = await self.daemon.run_blocking(self.resolve_artwork,
+                                                 song)
+
+        if artwork is not None:
+            popup.update(icon=artwork)
+
+        color = await self.artwork_color(artwork)
+
+        # set CAVA color, cached per thumbnail
+        if color is not None and int(self.config["cava"]) > 0:
+            await self.daemon.run_blocking(self.daemon.set_cava, artwork,
+                                           color, self.config)
+
+        self.export(artwork=artwork, color=color)
+
+        self.daemon.emit("on_song", server=self.label, song=current,
+                         status=status, artwork=artwork, color=color)
+
+        # Cache album art for upcoming songs
+        upcoming = await self.queue.upcoming(self.client, status,
+                                             self.prefetcher.depth)
+        self.prefetcher.schedule(upcoming)
+
+    def wants_color(self):
+        """ Return True if CAVA or the now playing export use colors
+        """
+
+        return (int(self.config["cava"]) > 0
+                or self.daemon.nowplaying is not None)
+
+    async def artwork_color(self, artwork):
+        """ Return dominant color of `artwork` if CAVA or export use it
+        """
+
+        if artwork is None or not self.wants_color():
+            return None
+
+        color, palette = await self.daemon.run_blocking(
+            artwork_colors, self.daemon.index, artwork)
+
+        return color
+
+    async def export_artwork(self, current):
+        """ Publish artwork of the song playing at startup, no popup
+        """
+
+        artwork = await self.daemon.run_blocking(self.resolve_artwork,
+                                                 current)
+        color = await self.artwork_color(artwork)
+
+        self.export(artwork=artwork, color=color)
+
+    def resolve_artwork(self, song):
+        """ Return path to thumbnail for `song`, or None
+
+        Tags may be lists, they are reduced like get_songinfo() does
+        for the prefetcher and --warm-cache, so all share index keys
+        """
+
+        song = get_songinfo(song)
+
+        return cache_artwork(
+            self.daemon.paths["cache"],
+            path.expanduser(self.config["music"]),
+            self.log,
+            song["file"],
+            song["artist"],
+            song["album"],
+            self.daemon.index,
+            self.daemon.cache,
+            self.daemon.thumb_sizes,
+            self.config["thumb_format"],
+            self.mpd_artwork,
+            self.daemon.remote_artwork if self.daemon.providers else None,
+        )
+
+    def warm_song(self, song):
+        """ Cache album art and colors for `song`, run by the prefetcher
+        """
+
+        if song["artist"] and song["album"]:
+            artwork = self.resolve_artwork(song)
+
+            # Colors too, so the song path only looks them up
+            if artwork is not None and self.wants_color():
+                artwork_colors(self.daemon.index, artwork)
+
+    def mpd_artwork(self, url, timeout=30):
+        """ Fetch artwork for `url` over MPD from an executor thread
+        """
+
+        if int(self.config["mpd_art"]) < 1:
+            return None, None
+
+        future = asyncio.run_coroutine_threadsafe(
+            get_artwork(self.client, url, self.log), self.daemon.loop)
+
+        try:
+            return future.result(timeout)
+        except (FutureTimeout, MPDError, OSError) as err:
+            future.cancel()
+            METRICS.count("mpd_art_error")
+            self.log.debug("MPD artwork failed: {}".format(err))
+            return None, None
+
+
 class MPDNotify:
 
     config = DEFAULTS
@@ -53,6 +631,7 @@ class MPDNotify:
     name = APP_NAME
     desc = APP_DESC
     icon = path.join(paths["runpath"], "images/mpnotd.svg")
+    watcher_class = MPDWatcher
 
     def __init__(self, auth=None, debug=False):
         """ MPD Notification Daemon
@@ -81,183 +660,265 @@ class MPDNotify:
         # Load user config
         self.config = load_config(self.name, self.inifile, self.config)
 
+        # Print what a running daemon is playing and quit, before
+        # logging truncates its log
+        if self.args.now:
+            sys.exit(print_now(self.config["state_file"],
+                               self.config["state_socket"], self.args.format,
+                               self.args.follow))
+
         # Start logging
         logfile = path.join(self.paths["cache"], "debug.log")
         self.log = get_logger(logfile, DEBUG)
         self.log.debug(u"\u2500" * 50)
 
-        # Open MPD connection
-        self.client = get_client(self.config, self.log)
+        # Stage timings go to the debug log as well
+        if DEBUG:
+            METRICS.log = self.log
 
         # If auth passed as arg, overwrite config
         if auth is not None:
             self.config["auth"] = auth
 
-        # Send password if set (untested)
-        if not self.config["auth"] == "":
-            auth_client(self.client, self.config["auth"], self.log)
+        self.loop = None
+        self.tasks = set()
+        self.watchers = []
+
+        # Servers to watch, each section inherits the main config
+        self.servers = load_servers(self.name, self.inifile, self.config)
+
+        # Remembers the applied color, only writes and signals changes.
+        # Color extraction pulls in NumPy, so it is only loaded if a
+        # server uses it
+        self.cava = None
+
+        cava = [config for label, config in self.servers
+                if int(config["cava"]) > 0]
+
+        if cava:
+            from .cavacolor import CavaColor
+            self.cava = CavaColor(cava[0])
+
+        # Index of known artwork hits and misses
+        self.index = ArtworkIndex(path.join(self.paths["cache"], "index.db"),
+                                  float(self.config["miss_ttl"]) * 3600)
+
+        # Web providers, checked now and connected on first use
+        self.providers = []
+
+        if str(self.config["providers"]).strip():
+            from .providers import make_providers
+
+            try:
+                self.providers = make_providers(self.config["providers"])
+            except ValueError as err:
+                self.log.error(err)
+                sys.exit("{}: {}".format(self.name, err))
+
+        self.remote = None
+        self.remote_lock = threading.Lock()
+
+        # One popup per category, D-Bus is set up on the first one
+        backends = {
+            "notify2": partial(Notify2Backend, self.name),
+            "null": NullBackend,
+            "recording": RecordingBackend,
+        }
+        backend = backends.get(str(self.config["notify_backend"]).strip())
+
+        if backend is None:
+            err = "Unknown notify_backend: {}, use one of {}".format(
+                self.config["notify_backend"], ", ".join(backends))
+            self.log.error(err)
+            sys.exit("{}: {}".format(self.name, err))
+
+        self.notifier = Notifier(backend(), self.log, self.config["timeout"])
+
+        # Now playing state for status bars and scripts
+        self.nowplaying = None
+
+        if self.config["state_file"] or self.config["state_socket"]:
+            self.nowplaying = NowPlaying(self.config["state_file"],
+                                         self.config["state_socket"],
+                                         self.log)
+
+        # User plugins, only loaded if the plugin dir has any
+        self.plugins = None
+
+        if int(self.config["plugin_workers"]) > 0 and path.isdir(
+                self.paths["plugins"]):
+            from .plugins import PluginManager
+
+            self.plugins = PluginManager(self.paths["plugins"], self.log,
+                                         self.config["plugin_workers"],
+                                         self.config["plugin_timeout"])
+            self.plugins.load()
+
+        self.thumb_sizes = [
+            int(size) for size in str(self.config["thumb_sizes"]).split(",")
+        ]
+
+        # Thumbnail budget, evicted on a timer
+        self.cache = CacheManager(
+            self.paths["cache"],
+            self.index,
+            self.log,
+            float(self.config["cache_size"]) * (1 << 20),
+            self.config["cache_entries"],
+            self.config["cache_age"],
+        )
+
+        # Cache artwork of every album up front and quit
+        if self.args.warm_cache:
+            from .warm import warm_cache
+
+            for label, config in self.servers:
+                print("Warming {}".format(label))
+                warm_cache(self.paths["cache"], config, self.log, self.index,
+                           self.cache, self.thumb_sizes,
+                           self.config["thumb_format"], self.args.jobs,
+                           self.providers)
+
+            self.cache.save()
+            self.index.close()
+            sys.exit(0)
 
-        # Start loop
+        # Start loop, connections are closed by run() while the loop
+        # is still running
         try:
-            self.mpd_events()
+            asyncio.run(self.run())
         except (KeyboardInterrupt, SystemExit):
-            quit_client(self.client, self.log)
+            self.cache.save()
+            self.index.close()
             sys.exit(1)
 
-    def mpd_events(self):
-        """ Display notifications for changes to MPD subsystems
+    async def run(self):
+        """ Watch every configured MPD server for events
         """
 
-        cachedir = self.paths["cache"]
-        musicdir = self.config["music"]
-        hostname = self.config["host"]
-        icon = self.icon
+        self.loop = asyncio.get_running_loop()
 
-        # Get initial status and outputs
-        _status = self.client.status()
-        _outputs = self.client.outputs()
+        self.watchers = [
+            self.watcher_class(self, label, config)
+            for label, config in self.servers
+        ]
 
-        while True:
+        self.spawn(self.evict_cache())
+
+        if self.nowplaying is not None:
+            await self.nowplaying.start()
 
-            # Clean cached artwork
-            clean_cache(cachedir, self.log)
+        if self.config["metrics"]:
+            self.spawn(self.write_metrics())
 
-            data = {"summary": hostname, "icon": icon}
+        # One watcher per music dir, servers may share one
+        if int(self.config["watch"]) > 0:
+            from .watch import MusicWatcher
 
-            # Watch MPDClient.idle for changes
-            subsystems = self.client.idle("player", "update", "output")
+            musicdirs = {path.expanduser(config["music"])
+                         for label, config in self.servers}
 
-            for subsys in subsystems:
-                self.log.debug("Subsys: {}".format(subsys))
+            for musicdir in musicdirs:
+                self.spawn(MusicWatcher(musicdir, self.index, self.log,
+                                        self.config["watch"],
+                                        self.config["watch_interval"]).run())
 
-                # Player state changed
-                if subsys == "player":
+        try:
+            await asyncio.gather(*(watcher.run()
+                                   for watcher in self.watchers))
+        finally:
+            self.shutdown()
 
-                    # Get current status
-                    status = self.client.status()
+    def shutdown(self):
+        """ Close connections, plugins and the state socket
+        """
 
-                    # Get current state
-                    state = status.get("state", "")
+        for watcher in self.watchers:
+            if watcher.prefetcher is not None:
+                watcher.prefetcher.stop()
+            if watcher.client is not None:
+                watcher.client.disconnect()
 
-                    self.log.debug("Player: {}".format(state))
+        if self.plugins is not None:
+            self.plugins.close()
 
-                    # Player paused
-                    if state == "pause":
+        if self.nowplaying is not None:
+            self.nowplaying.close()
 
-                        data["message"] = "<i>Playback paused...</i>"
-                        data["icon"] = self.icon
+    def spawn(self, coro):
+        """ Run `coro` as a task, keeping a reference until it is done
+        """
 
-                        Notification(**data)
+        task = asyncio.ensure_future(coro)
+        self.tasks.add(task)
+        task.add_done_callback(self._task_done)
 
-                    # Player stopped
-                    elif state == "stop":
+        return task
 
-                        data["message"] = "<i>Playback stopped...</i>"
-                        data["icon"] = self.icon
-                        self._status = None
+    def _task_done(self, task):
+        self.tasks.discard(task)
 
-                        Notification(**data)
+        if not task.cancelled() and task.exception() is not None:
+            METRICS.count("task_error")
+            self.log.error("Task failed", exc_info=task.exception())
 
-                    # Show current song
-                    elif state == "play" or _status["songid"] != status[
-                            "songid"]:
+    def emit(self, hook, **event):
+        """ Run plugin `hook` with `event` in the background
+        """
 
-                        current = get_currentsong(self.client)
+        if self.plugins is not None and self.plugins.hooked(hook):
+            self.spawn(self.plugins.emit(hook, event))
 
-                        # Only show after tag data is read
-                        if all(key in current
-                               for key in ("artist", "title", "album")):
+    async def run_blocking(self, func, *args):
+        """ Run blocking `func` in the default executor
+        """
 
-                            # cache album art
-                            artwork = cache_artwork(
-                                cachedir,
-                                musicdir,
-                                self.log,
-                                current["file"],
-                                current["artist"],
-                                current["album"],
-                            )
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, partial(func, *args))
 
-                            # notifcation payload
-                            data["summary"] = "Playing..."
-                            data[
-                                "message"] = "<b>{}</b>\nBy <b>{}</b>\nFrom <b>{}</b>".format(
-                                    current["title"], current["artist"],
-                                    current["album"])
-                            data["icon"] = artwork
+    async def evict_cache(self, interval=60):
+        """ Keep artwork cache within budget
+        """
 
-                            # Show Notification
-                            Notification(**data)
+        while True:
+            await asyncio.sleep(interval)
+            await self.run_blocking(self.cache.evict)
 
-                            # set CAVA color
-                            if int(self.config["cava"]) > 0:
-                                CavaColor(self.config, artwork)
+    async def write_metrics(self, interval=15):
+        """ Write stage timings and counters for the textfile collector
+        """
 
-                            # Cache album art for next song
-                            nextsong = get_nextsong(self.client, status)
-                            cache_artwork(
-                                cachedir,
-                                musicdir,
-                                self.log,
-                                nextsong["file"],
-                                nextsong["artist"],
-                                nextsong["album"],
-                            )
+        promfile = path.expanduser(self.config["metrics"])
 
-                    # Save status
-                    _status = status
+        while True:
+            await asyncio.sleep(interval)
 
-                # Upadte state changed
-                elif subsys == "update":
+            try:
+                await self.run_blocking(METRICS.write, promfile)
+            except OSError as err:
+                self.log.debug("Metrics not written: {}".format(err))
 
-                    if self.updating:
-                        data["message"] = "Database updated!"
-                        data["icon"] = "checkbox-checked"
-                        self.updating = False
-                    else:
-                        data["message"] = "Updating database..."
-                        data["icon"] = "content-loading"
-                        self.updating = True
+    def remote_artwork(self, artist, album):
+        """ Ask web providers for artwork, from an executor thread
+        """
 
-                    Notification(**data)
-                    self.log.debug(data["message"])
+        with self.remote_lock:
+            if self.remote is None:
+                from .providers import RemoteArtwork
 
-                # Outputs changed
-                elif subsys == "output":
-                    outputs = self.client.outputs()
+                self.remote = RemoteArtwork(self.providers, self.index,
+                                            self.log,
+                                            self.config["http_timeout"],
+                                            self.config["http_workers"])
 
-                    for _out, out in zip(_outputs, outputs):
+        return self.remote(artist, album)
 
-                        if _out["outputenabled"] != out["outputenabled"]:
+    def set_cava(self, artwork, color, config):
+        """ Apply CAVA color for `artwork` as server `config` asks, timed
+        """
 
-                            if out["outputenabled"] == "1":
-                                data["message"] = "Output {} enabled".format(
-                                    out["outputname"])
-                                data["icon"] = "dialog-info"
-                            else:
-                                data["message"] = "Output {} disabled!".format(
-                                    out["outputname"])
-                                data["icon"] = "dialog-error"
-
-                            Notification(**data)
-                            self.log.debug(data["message"])
-
-                    _outputs = outputs
-
-
-class Notification:
-
-    def __init__(self,
-                 summary=None,
-                 message=None,
-                 icon=None,
-                 timeout=10,
-                 **kwargs):
-
-        notify2.init(summary)
-        popup = notify2.Notification(summary, message, icon)
-        popup.set_timeout(int(timeout) * 1000)
-        popup.show()
+        with METRICS.timer("cava"):
+            self.cava.set_color(artwork, color, config)
 
 
 if __name__ == "__main__":
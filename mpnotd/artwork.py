@@ -2,27 +2,44 @@
 
 """Artwork methods"""
 
-import json
+import hashlib
 from glob import glob
-from os import path, remove
-from shutil import copyfile
-from urllib.error import HTTPError, URLError
-from urllib.parse import quote
-from urllib.request import Request, urlopen, urlretrieve
-
-from bs4 import BeautifulSoup
-from PIL import Image
-
-from .utils import get_valid_str
-
-
-def cache_artwork(cachedir, musicdir, log, url, artist, album):
+from io import BytesIO
+from os import getpid, path, remove, rename
+from threading import get_ident
+
+from .cache import artwork_key, legacy_thumb, make_shard, thumb_path
+from .metrics import METRICS
+
+# Thumbnail file extension and save options per format
+THUMB_FORMATS = {"png": "png", "jpeg": "jpg", "webp": "webp"}
+THUMB_OPTIONS = {
+    "png": {},
+    "jpeg": {"quality": 85, "optimize": True},
+    "webp": {"quality": 85, "method": 4},
+}
+
+
+def cache_artwork(cachedir,
+                  musicdir,
+                  log,
+                  url,
+                  artist,
+                  album,
+                  index=None,
+                  cache=None,
+                  sizes=(96, ),
+                  fmt="png",
+                  mpdart=None,
+                  remote=None):
     """Get album art thumbnail
 
     Attempt to find album art and thumbnail it
-    First look for existing thumbnail
+    First look for album in `index`, or the same album elsewhere
     Then find_image() searches filesystem
-    Or else fetch_image() searches web
+    Then `mpdart` asks MPD for cover files and embedded art
+    Then a thumbnail cached before the sharded layout is adopted
+    Or else `remote` asks web providers
 
     Args:
         cachedir (str): Path to cached artwork
@@ -31,52 +48,230 @@ def cache_artwork(cachedir, musicdir, log, url, artist, album):
         url (str): MPD database path or http url
         artist (str): Song artist
         album (str): Song ablum
+        index (obj): ArtworkIndex of known hits and misses, or None
+        cache (obj): CacheManager tracking thumbnail use, or None
+        sizes (list): Thumbnail sizes in pixels, first is returned
+        fmt (str): Thumbnail format, png, jpeg or webp
+        mpdart (callable): Returns (source, data) of artwork MPD has
+            for `url`, or None
+        remote (callable): Returns (source, data) of artwork from web
+            providers for `artist` and `album`, or None
 
     Returns:
        Return path to thumbnail or None
 
     """
 
-    # Temp file
-    tmpfile = path.join(cachedir, "artwork.tmp")
-    if path.exists(tmpfile):
-        remove(tmpfile)
-        log.debug("Purge tmp: {}".format(tmpfile))
+    albumdir = "" if url.startswith("http") else path.dirname(url)
+
+    # Known hits and misses cost one indexed lookup
+    if index is not None:
+        found, thumb = index.lookup(albumdir, artist, album)
+        if found:
+            log.debug("Indexed image: {}".format(thumb))
+            METRICS.count("artwork_hit" if thumb else "artwork_known_miss")
+
+            if cache is not None and thumb is not None:
+                cache.touch(thumb)
+
+            return thumb
+
+    # Another directory or stream of the same album
+    albumkey = artwork_key(artist, album)
+
+    if index is not None:
+        thumb = index.alias(albumkey)
+        if thumb is not None:
+            log.debug("Aliased image: {}".format(thumb))
+            METRICS.count("artwork_alias")
+            index.store(albumdir, artist, album, thumb)
 
-    # Get destination file path
-    filename = "cover-{}-{}.png".format(artist, album)
-    filename = get_valid_str(filename).lower()
-    filepath = path.join(cachedir, filename)
-    log.debug("Cache Dest: {}".format(filepath))
+            if cache is not None:
+                cache.touch(thumb)
 
-    # Check for cached image first
-    if path.exists(filepath):
-        log.debug("Found image: {}".format(filepath))
+            return thumb
+
+    mtime = None
+    origin = "local"
 
     # Try to find image in local path (even for streams... who knows)
-    elif find_image(musicdir, tmpfile, log, url, artist, album):
-        log.debug("Searching filesystem")
-        _mkthumb(tmpfile, filepath)
+    with METRICS.timer("local_search"):
+        source = find_image(musicdir, log, url, artist, album)
+
+        if source:
+            log.debug("Searching filesystem")
+            mtime = path.getmtime(source)
+            with open(source, "rb") as image_file:
+                data = image_file.read()
+
+    # Ask MPD, works without access to its music dir
+    if not source and mpdart is not None and not url.startswith("http"):
+        log.debug("Searching MPD")
+        origin = "mpd"
+        with METRICS.timer("mpd_art"):
+            source, data = mpdart(url)
+
+    # Thumbnail from an older version, saves asking the web again
+    if not source:
+        legacy = legacy_thumb(cachedir, artist, album)
+
+        try:
+            if legacy is not None:
+                with open(legacy, "rb") as image_file:
+                    data = image_file.read()
+
+                log.debug("Adopting cached image: {}".format(legacy))
+                origin = "legacy"
+                source = legacy
+
+        # Adopted by another thread meanwhile
+        except FileNotFoundError:
+            pass
+
+    # If not, ask web providers
+    if not source and remote is not None:
+        from .providers import RemoteUnavailable
 
-    # If not, search google
-    elif fetch_image(tmpfile, log, artist, album):
         log.debug("Searching web")
-        _mkthumb(tmpfile, filepath)
+        origin = "web"
+
+        try:
+            with METRICS.timer("web_fetch"):
+                source, data = remote(artist, album)
+
+        # Not a miss, try again next time
+        except RemoteUnavailable as err:
+            log.debug("Web providers unavailable: {}".format(err))
+            return None
+
+    thumb = None
+    METRICS.count("artwork_{}".format(origin if source else "missing"))
+
+    if source:
+        thumb = _store_thumb(cachedir, log, data, cache, sizes, fmt)
+
+        # Now kept under its content key
+        if origin == "legacy":
+            try:
+                remove(source)
+            except FileNotFoundError:
+                pass
+
+        if index is not None:
+            index.store_alias(albumkey, thumb)
+
+    if index is not None:
+        index.store(albumdir, artist, album, thumb, source, mtime)
+
+    return thumb
+
+
+def artwork_colors(index, thumb):
+    """Get dominant color and palette of a thumbnail
+
+    Computed once per thumbnail and kept in `index`, so later songs
+    from the same album only cost a lookup
+
+    Args:
+        index (obj): ArtworkIndex holding cached colors
+        thumb (str): Path to thumbnail
+
+    Returns:
+        Tuple of dominant hex color and list of palette hex colors
+
+    """
+
+    colors = index.colors(thumb)
+
+    if colors is None:
+        from .cavacolor import get_artwork_colors
+
+        with METRICS.timer("color"):
+            colors = get_artwork_colors(thumb)
+        index.store_colors(thumb, *colors)
+
+    return colors
+
+
+def _store_thumb(cachedir, log, data, cache=None, sizes=(96, ), fmt="png"):
 
-    return filepath
+    """ Return thumbnail of image `data`, stored by content
+
+    Identical source images share one set of thumbnails, so they are
+    only decoded and resized once. The first of `sizes` is returned.
+    """
+
+    digest = hashlib.sha1(data).hexdigest()
+    ext = THUMB_FORMATS[fmt]
+    thumbs = [thumb_path(cachedir, digest, size, ext) for size in sizes]
+
+    if path.exists(thumbs[0]):
+        log.debug("Shared image: {}".format(thumbs[0]))
+        METRICS.count("thumb_shared")
+
+        if cache is not None:
+            cache.touch(thumbs[0])
+
+    else:
+        make_shard(thumbs[0])
+        with METRICS.timer("thumbnail"):
+            size = _mkthumb(BytesIO(data), thumbs, sizes, fmt)
+
+        if cache is not None:
+            cache.add(thumbs[0], size)
+
+    return thumbs[0]
 
 
-def _mkthumb(in_file, out_file):
+def _mkthumb(in_file, out_files, sizes, fmt="png"):
 
-    """ Make thumbnail
+    """ Make thumbnails in `sizes` from one decode
+
+    JPEGs are decoded at reduced scale and other formats reduced by
+    an integer factor before resampling. Each smaller size is made
+    from the previous one. Files are written next to `out_files` and
+    renamed, so concurrent writers never expose a partial file.
+
+    Returns:
+        Total size of written files in bytes
     """
 
-    image = Image.open(in_file)
-    image.thumbnail((96, 96))
-    image.save(out_file)
+    from PIL import Image
+
+    largest = max(sizes)
+
+    with Image.open(in_file) as image:
+        # Let the decoder skip detail we throw away
+        image.draft("RGB", (largest, largest))
+        image.load()
+
+    # Resample in full color, palette images would fall back to nearest
+    if image.mode not in ("RGB", "RGBA"):
+        alpha = "A" in image.mode or "transparency" in image.info
+        image = image.convert("RGBA" if alpha else "RGB")
+
+    if fmt == "jpeg" and image.mode != "RGB":
+        image = image.convert("RGB")
+
+    factor = min(image.size) // (largest * 2)
+    if factor > 1:
+        image = image.reduce(factor)
 
+    total = 0
 
-def find_image(musicdir, tmpfile, log, url, artist=None, album=None):
+    for size, out_file in sorted(zip(sizes, out_files), reverse=True):
+        tmpfile = "{}.{}-{}.tmp".format(out_file, getpid(), get_ident())
+
+        image.thumbnail((size, size), Image.LANCZOS)
+        image.save(tmpfile, format=fmt.upper(), **THUMB_OPTIONS[fmt])
+        rename(tmpfile, out_file)
+
+        total += path.getsize(out_file)
+
+    return total
+
+
+def find_image(musicdir, log, url, artist=None, album=None):
     """Search filesystem for artwork
 
     If `url` starts with HTTP, we assume we're streaming and
@@ -90,7 +285,7 @@ def find_image(musicdir, tmpfile, log, url, artist=None, album=None):
         album (str): album name
 
     Return:
-        Return True if local image cached
+        Return path of image, or None
     """
 
     # If streaming... Guess!
@@ -110,62 +305,8 @@ def find_image(musicdir, tmpfile, log, url, artist=None, album=None):
 
             # Return first match
             if img_match:
-                copyfile(img_match[0], tmpfile)
                 log.debug("Local image found: {}".format(img_match[0]))
 
-                return True
-
-    return False
-
-
-def fetch_image(tmpfile, log, artist, album):
-    """Search web for artwork
-
-    This is slow but easy and free
-
-    Args:
-        artist (str): Song artist
-        album (str): Song album
-
-    Returns:
-        True if image was downloaded, False otherwise
-
-    """
+                return img_match[0]
 
-    # Build search request
-    search_string = "album art {} {}".format(album, artist)
-    search_url = ("https://www.google.com/search?q=" +
-                  quote(search_string.encode("utf-8")) +
-                  "&source=lnms&tbm=isch")
-    search_agent = {
-        "User-Agent":
-        """Mozilla/5.0 (X11; Linux x86_64)
-        AppleWebKit/534.30 (KHTML, like Gecko) Ubuntu/11.04
-        Chromium/12.0.742.112 Chrome/12.0.742.112 Safari/534.30"""
-    }
-
-    # Return search results
-    try:
-        results = BeautifulSoup(
-            urlopen(
-                Request(search_url, headers=search_agent)),
-            "html.parser")
-
-    except HTTPError as http_err:
-        if http_err.code == 404:
-            log.debug(http_err.code)
-        elif http_err.code == 403:
-            log.debug(http_err.code)
-    except URLError as url_err:
-        log.debug(url_err.reason)
-
-    # Find image on page
-    img_div = results.find("div", {"class": "rg_meta"})
-    img_url = json.loads(img_div.text)["ou"]
-
-    if urlretrieve(img_url, tmpfile):
-        log.debug("Search image found: {}".format(tmpfile))
-
-        return True
-
-    return False
+    return None
@@ -0,0 +1,234 @@
+# -*- coding: utf-8 -*-
+
+""" Artwork cache budget
+"""
+
+import hashlib
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from glob import glob
+from os import makedirs, path, remove
+
+from .utils import get_valid_str
+
+ART_DIR = "art"
+
+
+def artwork_key(artist, album):
+    """ Return stable cache key for an album
+
+    Tags are NFKC normalized and case folded, so any script is kept
+    and only spelling variants share a key
+    """
+
+    def normalize(text):
+        text = unicodedata.normalize("NFKC", text).casefold()
+        return " ".join(text.split())
+
+    name = "{}\0{}".format(normalize(artist), normalize(album))
+    return hashlib.sha1(name.encode("utf-8")).hexdigest()
+
+
+def key_path(cachedir, key, ext="png"):
+    """ Return sharded path for `key`, art/ab/cd/abcd....png
+    """
+
+    return path.join(cachedir, ART_DIR, key[:2], key[2:4],
+                     "{}.{}".format(key, ext))
+
+
+def thumb_path(cachedir, key, size, ext="png"):
+    """ Return sharded path for a `size` thumbnail of `key`
+    """
+
+    return key_path(cachedir, "{}-{}".format(key, size), ext)
+
+
+def thumb_files(filepath):
+    """ Return all sizes sharing the key and format of `filepath`
+    """
+
+    shard, filename = path.split(filepath)
+    key = filename.split("-")[0].split(".")[0]
+    ext = path.splitext(filename)[1]
+
+    return glob(path.join(shard, "{}*{}".format(key, ext)))
+
+
+def make_shard(filepath):
+    """ Create shard directory for `filepath`
+    """
+
+    makedirs(path.dirname(filepath), exist_ok=True)
+
+
+def legacy_thumb(cachedir, artist, album):
+    """ Return path of a flat cover-*.png thumbnail of an album, or None
+
+    Cached before thumbnails were sharded. Old names dropped
+    non-ASCII characters, so only albums whose names were kept whole
+    are looked up, others could pick up another album's thumbnail.
+    """
+
+    names = [get_valid_str(text) for text in (artist, album)]
+
+    if names != [text.replace(" ", "_") for text in (artist, album)]:
+        return None
+
+    filepath = path.join(cachedir, "cover-{}-{}.png".format(*names).lower())
+
+    return filepath if path.isfile(filepath) else None
+
+
+class CacheManager:
+
+    def __init__(self, cachedir, index, log, max_bytes=64 << 20,
+                 max_entries=10000, max_age=100):
+
+        """ CacheManager
+
+        Tracks cached thumbnails in memory, least recently used first,
+        and persists them in the ArtworkIndex. Eviction runs from
+        evict(), never on the event path.
+
+        Args:
+            cachedir (str): Path to cached artwork
+            index (obj): ArtworkIndex used for persistence
+            log (obj): The logger
+            max_bytes (int): Size budget in bytes
+            max_entries (int): Number of thumbnails to keep
+            max_age (int): Hours since last use to keep a thumbnail,
+                0 keeps them forever
+
+        """
+
+        self.cachedir = cachedir
+        self.index = index
+        self.log = log
+        self.max_bytes = int(max_bytes)
+        self.max_entries = int(max_entries)
+        self.max_age = float(max_age) * 3600
+
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.total = 0
+        self.dirty = set()
+
+        self._load()
+
+    def _load(self):
+
+        rows = self.index.load_files()
+
+        # First run, adopt thumbnails already in the cache dir
+        if not rows:
+            pattern = path.join(self.cachedir, ART_DIR, "*", "*", "*")
+            rows = [(filepath, path.getsize(filepath), path.getatime(filepath))
+                    for filepath in glob(pattern)
+                    if not filepath.endswith(".tmp")]
+            self.index.save_files(rows)
+
+        for filepath, size, atime in sorted(rows, key=lambda row: row[2]):
+            self.entries[filepath] = [size, atime]
+            self.total += size
+
+        self.log.debug("Cache: {} files, {} bytes".format(
+            len(self.entries), self.total))
+
+    def add(self, filepath, size=None):
+
+        """ Track a newly written thumbnail
+
+        Args:
+            filepath (str): Path to thumbnail
+            size (int): Bytes used by it and its other sizes, or None
+                to stat it
+
+        """
+
+        if size is None:
+            size = path.getsize(filepath)
+
+        with self.lock:
+            old = self.entries.pop(filepath, None)
+            if old is not None:
+                self.total -= old[0]
+
+            self.entries[filepath] = [size, time.time()]
+            self.total += size
+            self.dirty.add(filepath)
+
+    def touch(self, filepath):
+
+        """ Mark a thumbnail as used
+        """
+
+        with self.lock:
+            entry = self.entries.get(filepath)
+            if entry is not None:
+                entry[1] = time.time()
+                self.entries.move_to_end(filepath)
+                self.dirty.add(filepath)
+
+    def evict(self, batch=256):
+
+        """ Remove expired and least recently used thumbnails
+
+        At most `batch` files are removed per call, so a large backlog
+        is worked off over several timer ticks
+
+        Returns:
+            Number of removed files
+        """
+
+        removed = []
+        use_by = time.time() - self.max_age
+
+        with self.lock:
+            while self.entries and len(removed) < batch:
+                filepath, (size, atime) = next(iter(self.entries.items()))
+
+                over = (self.total > self.max_bytes
+                        or len(self.entries) > self.max_entries)
+                expired = self.max_age > 0 and atime < use_by
+
+                if not (over or expired):
+                    break
+
+                del self.entries[filepath]
+                self.dirty.discard(filepath)
+                self.total -= size
+                removed.append(filepath)
+
+        for filepath in removed:
+            self.log.debug("Removing: {}".format(filepath))
+
+            for sibling in thumb_files(filepath):
+                try:
+                    remove(sibling)
+                except FileNotFoundError:
+                    pass
+
+            self.index.forget_thumb(filepath)
+
+        if removed:
+            self.index.drop_files(removed)
+
+        self.save()
+
+        return len(removed)
+
+    def save(self):
+
+        """ Persist changed entries
+        """
+
+        with self.lock:
+            rows = [(filepath, *self.entries[filepath])
+                    for filepath in self.dirty]
+            self.dirty.clear()
+
+        if rows:
+            self.index.save_files(rows)
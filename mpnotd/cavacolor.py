@@ -3,16 +3,17 @@
 """ Change CAVA's foreground color based on album art
 """
 
-import fileinput
-import subprocess
-import sys
-from os import path
-
-from colorthief import ColorThief
-
-from colormath.color_conversions import convert_color
-from colormath.color_diff import delta_e_cie2000
-from colormath.color_objects import LabColor, sRGBColor
+import signal
+import threading
+import time
+from functools import lru_cache
+from os import (fdopen, getuid, kill, listdir, path, remove, replace,
+                stat)
+from shutil import copymode
+from tempfile import mkstemp
+
+import numpy as np
+from PIL import Image
 
 CAVA_CFG = path.expanduser("~/.config/cava/config")
 
@@ -25,121 +26,367 @@ CAVA_CFG = path.expanduser("~/.config/cava/config")
 #         }
 
 
+# sRGB (D65) to XYZ
+XYZ_MATRIX = np.array([
+    [0.4124564, 0.3575761, 0.1804375],
+    [0.2126729, 0.7151522, 0.0721750],
+    [0.0193339, 0.1191920, 0.9503041],
+])
+XYZ_WHITE = np.array([0.95047, 1.0, 1.08883])
+
+
+def get_artwork_colors(image, count=5, sample=64):
+
+    """ Return dominant color and palette of `image` as hex strings
+
+    Pixels of a `sample` sized copy are binned at 4 bits per channel,
+    the palette is the mean color of the most populated bins. Near
+    white and transparent pixels are ignored, as ColorThief did.
+    Meant to run once per thumbnail, the result is cached with it.
+    """
+
+    with Image.open(image) as img:
+        img.draft("RGB", (sample, sample))
+        img = img.convert("RGBA")
+
+    img.thumbnail((sample, sample))
+
+    pixels = np.asarray(img).reshape(-1, 4)
+    keep = (pixels[:, 3] >= 125) & ~(pixels[:, :3] > 250).all(axis=1)
+    if keep.any():
+        pixels = pixels[keep]
+
+    pixels = pixels[:, :3]
+    bins = (pixels >> 4).astype(np.intp)
+    bins = (bins[:, 0] << 8) | (bins[:, 1] << 4) | bins[:, 2]
+
+    counts = np.bincount(bins, minlength=4096)
+    top = np.argsort(counts, kind="stable")[::-1][:count]
+    top = top[counts[top] > 0]
+
+    sums = np.stack([
+        np.bincount(bins, weights=pixels[:, channel], minlength=4096)[top]
+        for channel in range(3)
+    ], axis=1)
+    means = np.rint(sums / counts[top, None]).astype(int)
+
+    palette = [_hex(rgb) for rgb in means]
+
+    return palette[0], palette
+
+
+def rgb_to_lab(rgb):
+
+    """ Convert array of 0-255 sRGB colors to CIE Lab (D65)
+    """
+
+    rgb = np.asarray(rgb, dtype=float) / 255.0
+    rgb = np.where(rgb <= 0.04045, rgb / 12.92, ((rgb + 0.055) / 1.055)**2.4)
+
+    xyz = rgb @ XYZ_MATRIX.T / XYZ_WHITE
+    xyz = np.where(xyz > (6 / 29)**3, np.cbrt(xyz),
+                   xyz / (3 * (6 / 29)**2) + 4 / 29)
+
+    fx, fy, fz = xyz[..., 0], xyz[..., 1], xyz[..., 2]
+
+    return np.stack([116 * fy - 16, 500 * (fx - fy), 200 * (fy - fz)],
+                    axis=-1)
+
+
+def delta_e_cie2000(lab1, lab2):
+
+    """ Return CIEDE2000 distances between Lab colors, broadcasting
+    """
+
+    lab1 = np.asarray(lab1, dtype=float)
+    lab2 = np.asarray(lab2, dtype=float)
+
+    L1, a1, b1 = lab1[..., 0], lab1[..., 1], lab1[..., 2]
+    L2, a2, b2 = lab2[..., 0], lab2[..., 1], lab2[..., 2]
+
+    c_bar7 = ((np.hypot(a1, b1) + np.hypot(a2, b2)) / 2)**7
+    g = 0.5 * (1 - np.sqrt(c_bar7 / (c_bar7 + 25**7)))
+
+    a1p = (1 + g) * a1
+    a2p = (1 + g) * a2
+    c1p = np.hypot(a1p, b1)
+    c2p = np.hypot(a2p, b2)
+    h1p = np.degrees(np.arctan2(b1, a1p)) % 360
+    h2p = np.degrees(np.arctan2(b2, a2p)) % 360
+
+    chroma = c1p * c2p
+    dh = h2p - h1p
+    dh = np.where(dh > 180, dh - 360, np.where(dh < -180, dh + 360, dh))
+    dh = np.where(chroma == 0, 0, dh)
+
+    dL = L2 - L1
+    dC = c2p - c1p
+    dH = 2 * np.sqrt(chroma) * np.sin(np.radians(dh / 2))
+
+    L_bar = (L1 + L2) / 2
+    c_bar7 = ((c1p + c2p) / 2)**7
+    h_sum = h1p + h2p
+    h_bar = np.where(
+        np.abs(h1p - h2p) > 180,
+        np.where(h_sum < 360, (h_sum + 360) / 2, (h_sum - 360) / 2),
+        h_sum / 2)
+    h_bar = np.where(chroma == 0, h_sum, h_bar)
+
+    t = (1 - 0.17 * np.cos(np.radians(h_bar - 30)) +
+         0.24 * np.cos(np.radians(2 * h_bar)) +
+         0.32 * np.cos(np.radians(3 * h_bar + 6)) -
+         0.20 * np.cos(np.radians(4 * h_bar - 63)))
+
+    s_l = 1 + 0.015 * (L_bar - 50)**2 / np.sqrt(20 + (L_bar - 50)**2)
+    s_c = 1 + 0.045 * (c1p + c2p) / 2
+    s_h = 1 + 0.015 * (c1p + c2p) / 2 * t
+
+    r_c = 2 * np.sqrt(c_bar7 / (c_bar7 + 25**7))
+    r_t = -np.sin(np.radians(60 * np.exp(-((h_bar - 275) / 25)**2))) * r_c
+
+    return np.sqrt((dL / s_l)**2 + (dC / s_c)**2 + (dH / s_h)**2 +
+                   r_t * (dC / s_c) * (dH / s_h))
+
+
+@lru_cache(maxsize=8)
+def load_palette(palette):
+
+    """ Return list of hex colors and Lab array for `palette`
+
+    Converted once per palette string, not once per track
+    """
+
+    colors = [hcolor.strip() for hcolor in palette.split(",")]
+    lab = rgb_to_lab([_rgb(hcolor) for hcolor in colors])
+
+    return colors, lab
+
+
+def _hex(rgb):
+    return '#{:02x}{:02x}{:02x}'.format(rgb[0], rgb[1], rgb[2])
+
+
+def _rgb(hcolor):
+    return tuple(int(hcolor.strip("#")[i:i + 2], 16) for i in (0, 2, 4))
+
+
 class CavaColor:
 
-    def __init__(self, config, image=None):
+    def __init__(self, config, image=None, color=None, cava_cfg=CAVA_CFG):
 
         """ CavaColor
 
+        Meant to live as long as the daemon, it remembers the applied
+        color, the parsed CAVA config and the cava processes to signal
+
         Args:
             config (dict): Dict containing `cava` and `cava_colors`
             image (str): Path to album art
+            color (str): Cached dominant hex color of `image`, or None
+                to compute it
+            cava_cfg (str): Path to CAVA config
 
         """
 
         self.enabled = config["cava"]
         self.palette = config["cava_colors"]
         self.image = image
+        self.cava_cfg = cava_cfg
 
-        if int(self.enabled) == 1:
-            if self.image is not None:
-                self.set_dominant_color(self.image)
-        elif int(self.enabled) == 2:
-            if self.image is not None and self.palette is not None:
-                self.set_palette_color(self.image, self.palette)
+        self.lock = threading.Lock()
+        self.current = None
+        self.lines = None
+        self.mtime = None
+        self.pids = set()
+        self.scanned = 0
 
-    def set_dominant_color(self, image):
+        # Convert palette once at config load
+        if int(self.enabled) == 2 and self.palette is not None:
+            load_palette(self.palette)
 
-        """ Set CAVA color with dominant color from artwork
+        if self.image is not None:
+            self.set_color(self.image, color)
+
+    def set_color(self, image, color=None, config=None):
+
+        """ Set CAVA color from artwork as configured by `cava`
+
+        A server `config` overriding `cava` or `cava_colors` is used
+        instead of the one given at init
         """
 
-        artwork = path.expanduser(image)
+        enabled, palette = self.enabled, self.palette
 
-        if path.exists(artwork):
+        if config is not None:
+            enabled, palette = config["cava"], config["cava_colors"]
 
-            # get dominant color
-            art_color = self.get_artwork_color(artwork)
+        if int(enabled) == 1:
+            self.set_dominant_color(image, color)
+        elif int(enabled) == 2 and palette is not None:
+            self.set_palette_color(image, palette, color)
 
-            # get hex
-            hex_color = '#{:02x}{:02x}{:02x}'.format(
-                art_color[0],
-                art_color[1],
-                art_color[2])
+    def set_dominant_color(self, image, color=None):
 
-            # write to config
-            self.update_config(CAVA_CFG, hex_color)
+        """ Set CAVA color with dominant color from artwork
+        """
 
-            # read config
-            self.restart_cava()
+        artwork = path.expanduser(image)
+
+        # get dominant color
+        if color is None and path.exists(artwork):
+            color = _hex(self.get_artwork_color(artwork))
+
+        if color is not None:
+            self.apply_color(color)
 
-    def set_palette_color(self, image, palette):
+    def set_palette_color(self, image, palette, color=None):
 
         """ Set CAVA color with nearest color in `palette`
         """
 
         artwork = path.expanduser(image)
-        palette = palette.split(",")
+        palette = load_palette(palette)
 
-        if path.exists(artwork):
+        # get dominant color
+        if color is None and path.exists(artwork):
+            color = _hex(self.get_artwork_color(artwork))
 
-            # get dominant color
-            dom_color = self.get_artwork_color(artwork)
+        if color is not None:
+
+            dom_color = _rgb(color)
 
             # return closest palette match
             color_match = self.get_palette_match(dom_color, palette)
 
+            self.apply_color(color_match)
+
+    def apply_color(self, color):
+
+        """ Write `color` and signal CAVA, unless it is already applied
+
+        Returns:
+            True if CAVA was updated
+        """
+
+        with self.lock:
+            if color == self.current:
+                return False
+
             # write to config
-            self.update_config(CAVA_CFG, color_match)
+            if not self.update_config(self.cava_cfg, color):
+                return False
 
             # read config
             self.restart_cava()
+            self.current = color
+
+        return True
 
     def get_artwork_color(self, image):
 
         """ Return dominant color from image
         """
 
-        return ColorThief(image).get_color(quality=1)
+        return _rgb(get_artwork_colors(image)[0])
 
     def get_palette_match(self, color, palette):
 
         """ Return palette color closest to given color
-        """
-
-        color1_rgb = sRGBColor(*color)
-        color1_lab = convert_color(color1_rgb, LabColor)
 
-        results = []
+        Args:
+            color (tuple): RGB color
+            palette (tuple): Hex colors and Lab array from load_palette()
 
-        # iterate palette and make list of results (dist, match)
-        for hcolor in palette:
+        """
 
-            color2 = tuple(
-                int(hcolor.strip("#")[i:i + 2], 16) for i in (0, 2, 4))
-            color2_rgb = sRGBColor(*color2)
-            color2_lab = convert_color(color2_rgb, LabColor)
+        colors, lab = palette
 
-            delta_e = delta_e_cie2000(color1_lab, color2_lab)
-            results.append((int(delta_e), hcolor))
+        delta_e = delta_e_cie2000(rgb_to_lab(color), lab)
 
-        # sort results and return first item (least distance)
-        results.sort()
-        return results[0][1]
+        return colors[int(np.argmin(delta_e))]
 
     def update_config(self, config, color):
 
         """ Find and replace `foreground` in CAVA_CFG
+
+        The parsed config is kept in memory and only read again when
+        the file changed behind our back. Written to a temp file and
+        renamed, so CAVA never reads a partial config.
+
+        Returns:
+            True if the config was written
         """
 
-        if path.exists(config):
-            for line in fileinput.input([config], inplace=True):
-                if line.strip().startswith("foreground ="):
-                    line = "foreground = '%s'\n" % color
-                sys.stdout.write(line)
+        try:
+            mtime = stat(config).st_mtime_ns
+        except FileNotFoundError:
+            return False
+
+        if self.lines is None or mtime != self.mtime:
+            with open(config) as cfg_file:
+                self.lines = cfg_file.readlines()
+
+        for num, line in enumerate(self.lines):
+            if line.strip().startswith("foreground ="):
+                self.lines[num] = "foreground = '%s'\n" % color
+
+        tmpfd, tmpfile = mkstemp(prefix=".config-", dir=path.dirname(config))
+
+        try:
+            with fdopen(tmpfd, "w") as tmp_cfg:
+                tmp_cfg.writelines(self.lines)
+            copymode(config, tmpfile)
+            replace(tmpfile, config)
+        except OSError:
+            remove(tmpfile)
+            raise
+
+        self.mtime = stat(config).st_mtime_ns
+
+        return True
 
-    def restart_cava(self):
+    def restart_cava(self, rescan=60):
 
         """ Force CAVA to read config and redraw
+
+        Signals the cava PIDs found by scanning /proc, which is only
+        done again when none of them is left or every `rescan` seconds
         """
 
-        subprocess.run(["pkill", "-USR2", "cava"])
+        if not self.pids or time.monotonic() - self.scanned > rescan:
+            self.pids = find_pids("cava")
+            self.scanned = time.monotonic()
+
+        for pid in list(self.pids):
+            try:
+                kill(pid, signal.SIGUSR2)
+            # Gone, or the PID was reused by another user's process
+            except (ProcessLookupError, PermissionError):
+                self.pids.discard(pid)
+
+
+def find_pids(name):
+
+    """ Return set of PIDs of our processes called `name`
+
+    Other users' processes are left out, they could not be signalled
+    """
+
+    pids = set()
+    uid = getuid()
+
+    for entry in listdir("/proc"):
+        if not entry.isdigit():
+            continue
+
+        try:
+            if stat(path.join("/proc", entry)).st_uid != uid:
+                continue
+
+            with open(path.join("/proc", entry, "comm")) as comm:
+                if comm.read().strip() == name:
+                    pids.add(int(entry))
+        except OSError:
+            continue
+
+    return pids
@@ -3,64 +3,363 @@
 """ MPD Client
 """
 
-from mpd import MPDClient, MPDError, ConnectionError
+import asyncio
+from functools import partial
 
+from mpd import CommandError, MPDError, ConnectionError
+from mpd.asyncio import BinaryCommandResult, MPDClient
 
-def get_client(config, log):
-    """ Setup MPD connection, return `client`
+# Bytes per albumart/readpicture chunk requested from MPD
+BINARY_LIMIT = 256 * 1024
+
+
+class NotifyClient(MPDClient):
+
+    """ asyncio MPDClient streaming binary responses into one buffer
+    """
+
+    async def _execute_binary(self, command, args):
+
+        """ Run `command` with increasing offsets until all chunks are read
+
+        python-mpd2 joins chunks with `+=`, copying the picture once per
+        chunk. Here the announced size is allocated up front and every
+        chunk is written into it in place. Otherwise it follows
+        python-mpd2's own version, including its private command
+        queue, setup.py pins the versions this was checked against.
+
+        Returns:
+            Response dict, `binary` holds a bytearray (empty if none)
+        """
+
+        args = list(args) + [0]
+        buffer = bytearray()
+        view = first = None
+        size = offset = 0
+
+        while True:
+            result = BinaryCommandResult()
+            await self._MPDClient__command_queue.put(result)
+            self._end_idle()
+            self._write_command(command, args)
+
+            metadata = await result
+            chunk = metadata.pop("binary", None)
+
+            if view is None:
+                first = metadata
+
+                if not chunk:
+                    break
+
+                try:
+                    size = int(metadata.get("size", len(chunk)))
+                except ValueError:
+                    raise CommandError(
+                        "Size data unsuitable for binary transfer")
+
+                buffer = bytearray(size)
+                view = memoryview(buffer)
+
+            # The file was replaced between chunks
+            elif metadata != first:
+                raise CommandError(
+                    "Metadata of binary data changed during transfer")
+
+            elif chunk is None:
+                raise CommandError("Binary field vanished during transfer")
+
+            end = offset + len(chunk)
+            if end > size:
+                raise CommandError("Binary data announced size exceeded")
+
+            view[offset:end] = chunk
+            offset = args[-1] = end
+
+            if offset == size:
+                break
+
+        metadata.pop("size", None)
+        metadata["binary"] = buffer
+
+        return metadata
+
+
+class MPDConnection:
+
+    def __init__(self,
+                 config,
+                 log,
+                 on_reconnect=None,
+                 pool=2,
+                 keepalive=30,
+                 max_backoff=60):
+
+        """ MPDConnection
+
+        A dedicated connection waits in idle, queries go to a small
+        pool of command connections. Dropped connections are opened
+        again with exponential backoff. Commands can be called as
+        methods, `await conn.status()`.
+
+        Args:
+            config (dict): Dict containing `host`, `port` and `auth`
+            log (obj): The logger
+            on_reconnect (coroutine function): Awaited after the idle
+                connection was opened again, to resync state
+            pool (int): Number of command connections
+            keepalive (int): Seconds between pings
+            max_backoff (int): Max seconds between connection attempts
+
+        """
+
+        self.config = config
+        self.log = log
+        self.on_reconnect = on_reconnect
+        self.pool_size = int(pool)
+        self.keepalive = keepalive
+        self.max_backoff = max_backoff
+
+        self.idle_client = None
+        self.pool = []
+        self.busy = {}
+        self.pool_lock = asyncio.Lock()
+        self.ping_task = None
+
+    def __getattr__(self, command):
+        return partial(self.call, command)
+
+    async def connect(self):
+
+        """ Open idle and command connections, retry until MPD answers
+        """
+
+        self.idle_client = await self._open_retry()
+
+        async with self.pool_lock:
+            await self._fill_pool()
+
+        if self.ping_task is None:
+            self.ping_task = asyncio.ensure_future(self._ping())
+
+    async def call(self, command, *args):
+
+        """ Run `command` on the least busy command connection
+
+        A dropped command connection is opened again and the command
+        retried once
+        """
+
+        for attempt in (0, 1):
+            if not all(client.connected for client in self.pool):
+                await self._replace()
+
+            client = min(self.pool, key=lambda conn: self.busy[id(conn)])
+            self.busy[id(client)] += 1
+
+            try:
+                return await getattr(client, command)(*args)
+            except (ConnectionError, OSError) as conn_err:
+                if attempt:
+                    raise
+                self.log.warning("MPD command conn lost: {}".format(conn_err))
+                client.disconnect()
+            finally:
+                if id(client) in self.busy:
+                    self.busy[id(client)] -= 1
+
+    async def idle(self, subsystems=()):
+
+        """ Yield lists of changed subsystems, forever
+
+        If the idle connection drops it is opened again and
+        `on_reconnect` awaited before watching resumes
+        """
+
+        while True:
+            try:
+                async for changes in self.idle_client.idle(subsystems):
+                    yield changes
+            except (ConnectionError, OSError) as conn_err:
+                self.log.warning("MPD idle conn lost: {}".format(conn_err))
+
+            quit_client(self.idle_client, self.log)
+            self.idle_client = await self._open_retry()
+
+            if self.on_reconnect is not None:
+                try:
+                    await self.on_reconnect()
+                except (MPDError, OSError):
+                    self.log.exception("MPD resync failed")
+
+    def disconnect(self):
+
+        """ Close all connections
+        """
+
+        if self.ping_task is not None:
+            self.ping_task.cancel()
+            self.ping_task = None
+
+        for client in [self.idle_client] + self.pool:
+            if client is not None:
+                quit_client(client, self.log)
+
+        self.idle_client = None
+        self.pool = []
+        self.busy = {}
+
+    async def _open(self):
+        client = await get_client(self.config, self.log)
+
+        # Send password if set (untested)
+        if not self.config["auth"] == "":
+            await auth_client(client, self.config["auth"], self.log)
+
+        return client
+
+    async def _open_retry(self):
+        delay = 1
+
+        while True:
+            try:
+                return await self._open()
+            except (ConnectionError, OSError):
+                self.log.debug("MPD retry in {}s".format(delay))
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, self.max_backoff)
+
+    async def _fill_pool(self):
+        while len(self.pool) < self.pool_size:
+            client = await self._open_retry()
+            self.pool.append(client)
+            self.busy[id(client)] = 0
+
+    async def _replace(self):
+        async with self.pool_lock:
+            # Another call may have replaced them already
+            for client in [conn for conn in self.pool if not conn.connected]:
+                self.pool.remove(client)
+                self.busy.pop(id(client), None)
+
+            await self._fill_pool()
+
+    async def _ping(self):
+
+        # Drop connections that stopped answering, e.g. after the
+        # network went away without closing the socket
+        while True:
+            await asyncio.sleep(self.keepalive)
+
+            for client in [self.idle_client] + self.pool:
+                if client is None or not client.connected:
+                    continue
+
+                try:
+                    await asyncio.wait_for(client.ping(), self.keepalive)
+                except (asyncio.TimeoutError, ConnectionError, OSError):
+                    self.log.warning("MPD ping failed")
+                    client.disconnect()
+
+
+async def get_client(config, log):
+    """ Setup asyncio MPD connection, return `client`
     """
 
     host = config["host"]
     port = config["port"]
 
-    client = MPDClient()
+    client = NotifyClient()
 
     try:
-        client.connect(host, port)
+        await client.connect(host, port)
         log.debug("MPD connection established!")
-    except ConnectionError as conn_err:
+    except (ConnectionError, OSError) as conn_err:
         log.exception("MPD Conn error: {}".format(conn_err))
         raise
 
+    # Fewer round trips for artwork, MPD 0.22.4 and later
+    try:
+        await client.binarylimit(BINARY_LIMIT)
+    except CommandError:
+        log.debug("MPD binarylimit not supported")
+
     return client
 
 
-def get_currentsong(client):
+async def get_artwork(client, url, log):
+    """ Return (source, data) of artwork MPD has for `url`
+
+    Tries the cover file in the song's directory (albumart), then a
+    picture embedded in its tags (readpicture).
+    `data` is a bytearray, both are None if MPD has no artwork.
+    """
+
+    for command in ("albumart", "readpicture"):
+        try:
+            response = await getattr(client, command)(url)
+        except CommandError as cmd_err:
+            log.debug("MPD {}: {}".format(command, cmd_err))
+            continue
+
+        if response.get("binary"):
+            log.debug("MPD {} found: {}".format(command, url))
+            return "mpd:{}:{}".format(command, url), response["binary"]
+
+    return None, None
+
+
+async def get_currentsong(client):
     """ Return current song dict
     """
 
-    return client.currentsong()
+    return await client.currentsong()
 
 
-def get_nextsong(client, status):
-    """ Return next song dict
+def get_songinfo(song):
+    """ Return dict with `file`, `artist`, `title` and `album` of `song`
+
+    Repeated tags, which python-mpd2 returns as lists, are reduced
+    to their first value. Untagged streams may carry
+    "artist - title - album" in `name`, any missing part is left empty
     """
 
-    next_id = status["nextsongid"]
-    song = client.playlistid(next_id)[0]
-    url = song["file"]
+    artist = _first(song.get("artist", ""))
+    title = _first(song.get("title", ""))
+    album = _first(song.get("album", ""))
 
-    if "name" in song:
-        artist, title, album = song["name"].split(" - ")
-    else:
-        artist = song["artist"]
-        album = song["album"]
+    if "name" in song and not (artist and title and album):
+        parts = _first(song["name"]).split(" - ")
+        artist = artist or parts[0]
+        if len(parts) > 1:
+            title = title or parts[1]
+        if len(parts) > 2:
+            album = album or " - ".join(parts[2:])
 
-    nextsong = {
-        "file": url,
+    return {
+        "file": song["file"],
         "artist": artist,
+        "title": title,
         "album": album,
     }
 
-    return nextsong
+
+def _first(value):
+    """ Return first value of a repeated tag
+    """
+
+    if isinstance(value, list):
+        return value[0] if value else ""
+
+    return value
 
 
-def auth_client(client, password, log):
+async def auth_client(client, password, log):
     """ Authenticate to MPD server
     """
 
     try:
-        client.password(password)
+        await client.password(password)
         log.debug("MPD Auth accepted!")
     except MPDError as mpd_err:
         log.exception("MPD Auth error: {}".format(mpd_err))
@@ -70,6 +369,6 @@ def quit_client(client, log):
     """ End MPD connection
     """
 
-    client.close()
-    client.disconnect()
+    if client.connected:
+        client.disconnect()
     log.debug("MPD connection closed!")
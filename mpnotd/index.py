@@ -0,0 +1,262 @@
+# -*- coding: utf-8 -*-
+
+""" Persistent artwork index
+"""
+
+import sqlite3
+import threading
+import time
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS artwork (
+    albumdir TEXT NOT NULL,
+    artist TEXT NOT NULL,
+    album TEXT NOT NULL,
+    thumb TEXT,
+    source TEXT,
+    mtime REAL,
+    missing INTEGER NOT NULL DEFAULT 0,
+    updated REAL NOT NULL,
+    PRIMARY KEY (albumdir, artist, album)
+);
+CREATE INDEX IF NOT EXISTS artwork_thumb ON artwork (thumb);
+CREATE TABLE IF NOT EXISTS aliases (
+    albumkey TEXT PRIMARY KEY,
+    thumb TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS aliases_thumb ON aliases (thumb);
+CREATE TABLE IF NOT EXISTS colors (
+    thumb TEXT PRIMARY KEY,
+    color TEXT NOT NULL,
+    palette TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS remote_misses (
+    provider TEXT NOT NULL,
+    albumkey TEXT NOT NULL,
+    updated REAL NOT NULL,
+    PRIMARY KEY (provider, albumkey)
+);
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    atime REAL NOT NULL
+);
+"""
+
+
+class ArtworkIndex:
+
+    def __init__(self, dbfile, miss_ttl=86400):
+
+        """ ArtworkIndex
+
+        Maps an album (directory, artist and album) to its thumbnail,
+        so a cached hit or a known miss never touches the music dir
+
+        Args:
+            dbfile (str): Path to SQLite database
+            miss_ttl (int): Seconds before a known miss is retried
+
+        """
+
+        self.dbfile = dbfile
+        self.miss_ttl = int(miss_ttl)
+        self.lock = threading.Lock()
+
+        # Shared by executor threads, serialized by `lock`
+        self.db = sqlite3.connect(dbfile, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.executescript(SCHEMA)
+
+    def lookup(self, albumdir, artist, album):
+
+        """ Return (found, thumb) for an album
+
+        `found` is False when the album is unknown or a miss has
+        expired, `thumb` is None for a known miss
+        """
+
+        with self.lock:
+            row = self.db.execute(
+                "SELECT thumb, missing, updated FROM artwork "
+                "WHERE albumdir = ? AND artist = ? AND album = ?",
+                (albumdir, artist, album)).fetchone()
+
+        if row is None:
+            return False, None
+
+        thumb, missing, updated = row
+
+        if missing:
+            if time.time() - updated > self.miss_ttl:
+                return False, None
+            return True, None
+
+        return True, thumb
+
+    def store(self, albumdir, artist, album, thumb, source=None, mtime=None):
+
+        """ Record thumbnail for an album, or a miss if `thumb` is None
+        """
+
+        with self.lock, self.db:
+            self.db.execute(
+                "INSERT OR REPLACE INTO artwork "
+                "(albumdir, artist, album, thumb, source, mtime, missing, "
+                "updated) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (albumdir, artist, album, thumb, source, mtime,
+                 int(thumb is None), time.time()))
+
+    def alias(self, albumkey):
+
+        """ Return thumbnail shared by an artist and album key, or None
+        """
+
+        with self.lock:
+            row = self.db.execute(
+                "SELECT thumb FROM aliases WHERE albumkey = ?",
+                (albumkey, )).fetchone()
+
+        return row[0] if row is not None else None
+
+    def store_alias(self, albumkey, thumb):
+
+        """ Point an artist and album key at a thumbnail
+        """
+
+        with self.lock, self.db:
+            self.db.execute(
+                "INSERT OR REPLACE INTO aliases (albumkey, thumb) "
+                "VALUES (?, ?)", (albumkey, thumb))
+
+    def forget_thumb(self, thumb):
+
+        """ Drop entries pointing at a removed thumbnail
+        """
+
+        with self.lock, self.db:
+            self.db.execute("DELETE FROM artwork WHERE thumb = ?", (thumb, ))
+            self.db.execute("DELETE FROM aliases WHERE thumb = ?", (thumb, ))
+            self.db.execute("DELETE FROM colors WHERE thumb = ?", (thumb, ))
+
+    def album_dirs(self):
+
+        """ Return set of album directories with known artwork or misses
+        """
+
+        with self.lock:
+            rows = self.db.execute(
+                "SELECT DISTINCT albumdir FROM artwork "
+                "WHERE albumdir != ''").fetchall()
+
+        return {row[0] for row in rows}
+
+    def forget_dir(self, albumdir, albumkey):
+
+        """ Drop entries for an album directory whose images changed
+
+        Args:
+            albumdir (str): Album directory
+            albumkey (callable): Returns alias key of (artist, album)
+
+        Returns:
+            Number of albums forgotten
+
+        """
+
+        with self.lock, self.db:
+            albums = self.db.execute(
+                "SELECT artist, album FROM artwork WHERE albumdir = ?",
+                (albumdir, )).fetchall()
+            self.db.execute("DELETE FROM artwork WHERE albumdir = ?",
+                            (albumdir, ))
+            self.db.executemany("DELETE FROM aliases WHERE albumkey = ?",
+                                [(albumkey(*album), ) for album in albums])
+
+        return len(albums)
+
+    def colors(self, thumb):
+
+        """ Return (color, palette) of a thumbnail, or None
+        """
+
+        with self.lock:
+            row = self.db.execute(
+                "SELECT color, palette FROM colors WHERE thumb = ?",
+                (thumb, )).fetchone()
+
+        if row is None:
+            return None
+
+        return row[0], row[1].split(",")
+
+    def store_colors(self, thumb, color, palette):
+
+        """ Record dominant color and palette of a thumbnail
+        """
+
+        with self.lock, self.db:
+            self.db.execute(
+                "INSERT OR REPLACE INTO colors (thumb, color, palette) "
+                "VALUES (?, ?, ?)", (thumb, color, ",".join(palette)))
+
+    def remote_missed(self, provider, albumkey):
+
+        """ Return True if `provider` had no artwork for an album
+        within `miss_ttl`
+        """
+
+        with self.lock:
+            row = self.db.execute(
+                "SELECT updated FROM remote_misses "
+                "WHERE provider = ? AND albumkey = ?",
+                (provider, albumkey)).fetchone()
+
+        return row is not None and time.time() - row[0] <= self.miss_ttl
+
+    def store_remote_miss(self, provider, albumkey):
+
+        """ Record that `provider` has no artwork for an album
+        """
+
+        with self.lock, self.db:
+            self.db.execute(
+                "INSERT OR REPLACE INTO remote_misses "
+                "(provider, albumkey, updated) VALUES (?, ?, ?)",
+                (provider, albumkey, time.time()))
+
+    def load_files(self):
+
+        """ Return list of (path, size, atime) for cached files
+        """
+
+        with self.lock:
+            return self.db.execute(
+                "SELECT path, size, atime FROM files").fetchall()
+
+    def save_files(self, rows):
+
+        """ Store (path, size, atime) rows for cached files
+        """
+
+        with self.lock, self.db:
+            self.db.executemany(
+                "INSERT OR REPLACE INTO files (path, size, atime) "
+                "VALUES (?, ?, ?)", rows)
+
+    def drop_files(self, paths):
+
+        """ Forget removed cached files
+        """
+
+        with self.lock, self.db:
+            self.db.executemany("DELETE FROM files WHERE path = ?",
+                                [(filepath, ) for filepath in paths])
+
+    def close(self):
+
+        """ Close database
+        """
+
+        with self.lock:
+            self.db.close()
@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+
+""" Hot path timings and counters
+"""
+
+import threading
+import time
+from contextlib import contextmanager
+from os import path, replace
+
+from .utils import _makedirs
+
+# Histogram bucket bounds in seconds
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+class Metrics:
+
+    def __init__(self, prefix="mpnotd"):
+
+        """ Metrics
+
+        Stage timings go into histograms, events into counters. Both
+        are rendered in the Prometheus text format.
+
+        Args:
+            prefix (str): Metric name prefix
+
+        """
+
+        self.prefix = prefix
+        self.log = None
+        self.lock = threading.Lock()
+        self.stages = {}
+        self.counters = {}
+        self.changed = False
+
+    @contextmanager
+    def timer(self, stage):
+
+        """ Time the body of a `with` block as `stage`
+        """
+
+        start = time.perf_counter()
+
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - start)
+
+    def observe(self, stage, seconds):
+
+        """ Record a `stage` duration in seconds
+        """
+
+        with self.lock:
+            hist = self.stages.get(stage)
+            if hist is None:
+                hist = self.stages[stage] = [0] * len(BUCKETS) + [0, 0.0, 0.0]
+
+            for num, bound in enumerate(BUCKETS):
+                if seconds <= bound:
+                    hist[num] += 1
+
+            # count, sum, max
+            hist[-3] += 1
+            hist[-2] += seconds
+            hist[-1] = max(hist[-1], seconds)
+            self.changed = True
+
+        if self.log is not None:
+            self.log.debug("Time {}: {:.1f}ms".format(stage, seconds * 1000))
+
+    def count(self, event, value=1):
+
+        """ Add `value` to the `event` counter
+        """
+
+        with self.lock:
+            self.counters[event] = self.counters.get(event, 0) + value
+            self.changed = True
+
+    def render(self):
+
+        """ Return metrics in the Prometheus text format
+        """
+
+        name = "{}_stage_seconds".format(self.prefix)
+        lines = [
+            "# HELP {} Time spent per hot path stage".format(name),
+            "# TYPE {} histogram".format(name),
+        ]
+
+        with self.lock:
+            stages = {stage: list(hist) for stage, hist in self.stages.items()}
+            counters = dict(self.counters)
+
+        for stage, hist in sorted(stages.items()):
+            for bound, count in zip(BUCKETS, hist):
+                lines.append('{}_bucket{{stage="{}",le="{}"}} {}'.format(
+                    name, stage, bound, count))
+            lines += [
+                '{}_bucket{{stage="{}",le="+Inf"}} {}'.format(
+                    name, stage, hist[-3]),
+                '{}_count{{stage="{}"}} {}'.format(name, stage, hist[-3]),
+                '{}_sum{{stage="{}"}} {:.6f}'.format(name, stage, hist[-2]),
+            ]
+
+        name = "{}_stage_max_seconds".format(self.prefix)
+        lines += [
+            "# HELP {} Slowest run per hot path stage".format(name),
+            "# TYPE {} gauge".format(name),
+        ]
+        lines += [
+            '{}{{stage="{}"}} {:.6f}'.format(name, stage, hist[-1])
+            for stage, hist in sorted(stages.items())
+        ]
+
+        name = "{}_events_total".format(self.prefix)
+        lines += [
+            "# HELP {} Cache hits, misses and errors".format(name),
+            "# TYPE {} counter".format(name),
+        ]
+        lines += [
+            '{}{{event="{}"}} {}'.format(name, event, value)
+            for event, value in sorted(counters.items())
+        ]
+
+        return "\n".join(lines) + "\n"
+
+    def write(self, promfile):
+
+        """ Write metrics to `promfile` if anything changed
+
+        Written to a temp file and renamed, as the node exporter
+        textfile collector expects
+        """
+
+        with self.lock:
+            if not self.changed:
+                return
+            self.changed = False
+
+        if not path.exists(promfile):
+            _makedirs(promfile)
+
+        tmpfile = "{}.tmp".format(promfile)
+
+        with open(tmpfile, "w") as prom:
+            prom.write(self.render())
+
+        replace(tmpfile, promfile)
+
+
+# Shared by every module of the daemon
+METRICS = Metrics()
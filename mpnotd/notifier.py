@@ -0,0 +1,198 @@
+# -*- coding: utf-8 -*-
+
+""" Desktop notifications, one popup per category
+"""
+
+import asyncio
+import time
+
+from .metrics import METRICS
+
+
+class Popup:
+
+    def __init__(self, notifier, key, fields):
+
+        """ Popup
+
+        Handle of a popup shown by Notifier. Updates are dropped once
+        another popup took its place.
+        """
+
+        self.notifier = notifier
+        self.key = key
+        self.fields = fields
+        self.shown = False
+
+    def update(self, **fields):
+
+        """ Replace `fields` of the popup in place, e.g. `icon`
+        """
+
+        self.notifier._update(self, fields)
+
+
+class Notifier:
+
+    def __init__(self, backend, log, timeout=10):
+
+        """ Notifier
+
+        Keeps one popup per key, e.g. (server, "player"), each new
+        one replaces the last in place instead of stacking. Popups
+        and updates made in one loop iteration are sent once, only
+        the latest per key.
+
+        Args:
+            backend (obj): Notify2Backend, NullBackend or
+                RecordingBackend
+            log (obj): The logger
+            timeout (int): Seconds before popups expire
+
+        """
+
+        self.backend = backend
+        self.log = log
+        self.timeout = int(timeout)
+        self.current = {}
+        self.pending = {}
+        self.scheduled = False
+
+    def show(self, key, summary=None, message=None, icon=None):
+
+        """ Show popup for `key`, replacing the last one
+
+        Returns:
+            Popup handle
+
+        """
+
+        popup = Popup(self, key, {
+            "summary": summary,
+            "message": message,
+            "icon": icon,
+            "timeout": self.timeout,
+        })
+        self.current[key] = popup
+        self._queue(popup)
+
+        return popup
+
+    def _update(self, popup, fields):
+        if self.current.get(popup.key) is not popup:
+            return
+
+        popup.fields.update(fields)
+        self._queue(popup)
+
+    def _queue(self, popup):
+        self.pending[popup.key] = popup
+
+        if not self.scheduled:
+            self.scheduled = True
+            asyncio.get_running_loop().call_soon(self._flush)
+
+    def _flush(self):
+        self.scheduled = False
+        pending, self.pending = self.pending, {}
+
+        for popup in pending.values():
+            try:
+                with METRICS.timer("notify_show"):
+                    if popup.shown:
+                        self.backend.update(popup)
+                    else:
+                        self.backend.show(popup)
+            except self.backend.errors as err:
+                METRICS.count("notify_error")
+                self.log.warning("Popup not shown: {}".format(err))
+                self.backend.forget(popup.key)
+            else:
+                popup.shown = True
+
+
+class NullBackend:
+
+    """ Backend dropping every popup, runs without a desktop session
+    """
+
+    # Exceptions meaning a popup could not be shown
+    errors = ()
+
+    def show(self, popup):
+        pass
+
+    def update(self, popup):
+        pass
+
+    def forget(self, key):
+        pass
+
+
+class RecordingBackend(NullBackend):
+
+    """ Backend recording when popups are shown and updated
+
+    Each record is (monotonic time, "show" or "update", popup id,
+    message, icon)
+    """
+
+    def __init__(self):
+        self.records = []
+
+    def show(self, popup):
+        self._record("show", popup)
+
+    def update(self, popup):
+        self._record("update", popup)
+
+    def _record(self, kind, popup):
+        self.records.append((time.monotonic(), kind, id(popup),
+                             popup.fields["message"], popup.fields["icon"]))
+
+
+class Notify2Backend(NullBackend):
+
+    def __init__(self, app_name):
+
+        """ Notify2Backend
+
+        Initializes the D-Bus binding on the first popup and keeps
+        one notification per key, shown again with its id so the
+        notification server replaces it
+        """
+
+        self.app_name = app_name
+        self.notify2 = None
+        self.popups = {}
+
+    def show(self, popup):
+        if self.notify2 is None:
+            # D-Bus bindings load on the first popup, not at startup
+            import dbus
+            import notify2
+
+            self.errors = (dbus.exceptions.DBusException, )
+            notify2.init(self.app_name)
+            self.notify2 = notify2
+
+        fields = popup.fields
+        notification = self.popups.get(popup.key)
+
+        if notification is None:
+            notification = self.popups[popup.key] = self.notify2.Notification(
+                fields["summary"], fields["message"], fields["icon"])
+        else:
+            notification.update(fields["summary"], fields["message"],
+                                fields["icon"])
+
+        notification.set_timeout(fields["timeout"] * 1000)
+        notification.show()
+
+    def update(self, popup):
+        self.show(popup)
+
+    def forget(self, key):
+        # Shown as a new popup next time, e.g. after the server restarted
+        self.popups.pop(key, None)
+
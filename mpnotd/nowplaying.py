@@ -0,0 +1,236 @@
+# -*- coding: utf-8 -*-
+
+""" Now playing state for status bars and scripts
+"""
+
+import asyncio
+import json
+import socket
+import sys
+import threading
+import time
+from os import path, remove, replace
+
+from .utils import _makedirs
+
+# Bytes queued for a subscriber before it is dropped as stuck
+SUBSCRIBER_BUFFER = 64 * 1024
+
+
+class NowPlaying:
+
+    def __init__(self, statefile, sockpath, log):
+
+        """ NowPlaying
+
+        Holds what each server is playing and publishes it as JSON,
+        to `statefile` (replaced atomically) and to every subscriber
+        of the Unix socket `sockpath`, one line per change. Changes
+        made in one loop iteration are published once.
+
+        Args:
+            statefile (str): Path of the JSON file, blank disables
+            sockpath (str): Path of the Unix socket, blank disables
+            log (obj): The logger
+
+        """
+
+        self.statefile = path.expanduser(statefile) if statefile else ""
+        self.sockpath = path.expanduser(sockpath) if sockpath else ""
+        self.log = log
+
+        self.state = {"server": None, "servers": {}}
+        self.text = json.dumps(self.state)
+        self.lock = threading.Lock()
+        self.scheduled = False
+        self.subscribers = set()
+        self.server = None
+
+    async def start(self):
+
+        """ Listen on the socket and write the initial state
+        """
+
+        if self.sockpath:
+            _makedirs(self.sockpath)
+
+            # Another daemon is publishing there, leave it alone
+            if path.exists(self.sockpath) and await self._listening():
+                self.log.warning("State socket in use, not listening: "
+                                 "{}".format(self.sockpath))
+            else:
+                # Left behind by a daemon that did not exit cleanly
+                if path.exists(self.sockpath):
+                    remove(self.sockpath)
+
+                self.server = await asyncio.start_unix_server(
+                    self._subscribe, self.sockpath)
+
+        self._schedule()
+
+    async def _listening(self):
+
+        """ Return True if something accepts connections on the socket
+        """
+
+        try:
+            reader, writer = await asyncio.open_unix_connection(self.sockpath)
+        except OSError:
+            return False
+
+        writer.close()
+
+        return True
+
+    def close(self):
+
+        """ Stop listening and remove the socket
+        """
+
+        if self.server is not None:
+            self.server.close()
+            self.server = None
+
+            if path.exists(self.sockpath):
+                remove(self.sockpath)
+
+    def update(self, server, **fields):
+
+        """ Set `fields` of `server`, which becomes the current server
+        """
+
+        state = self.state["servers"].setdefault(server, {})
+        state.update(fields)
+        state["updated"] = round(time.time(), 3)
+        self.state["server"] = server
+
+        self._schedule()
+
+    def _schedule(self):
+        if not self.scheduled:
+            self.scheduled = True
+            asyncio.get_running_loop().call_soon(self._publish)
+
+    def _publish(self):
+        self.scheduled = False
+        self.text = json.dumps(self.state, sort_keys=True)
+
+        line = (self.text + "\n").encode("utf-8")
+
+        for writer in list(self.subscribers):
+            self._send(writer, line)
+
+        if self.statefile:
+            asyncio.get_running_loop().run_in_executor(None, self._write)
+
+    def _write(self):
+
+        # Always writes the latest state, so a late write can not
+        # replace a newer one
+        with self.lock:
+            if not path.exists(self.statefile):
+                _makedirs(self.statefile)
+
+            tmpfile = "{}.tmp".format(self.statefile)
+
+            try:
+                with open(tmpfile, "w") as out:
+                    out.write(self.text)
+                replace(tmpfile, self.statefile)
+            except OSError as err:
+                self.log.debug("State not written: {}".format(err))
+
+    async def _subscribe(self, reader, writer):
+        self.subscribers.add(writer)
+        self._send(writer, (self.text + "\n").encode("utf-8"))
+        self.log.debug("State subscribers: {}".format(len(self.subscribers)))
+
+        # Subscribers only listen, wait for them to hang up
+        try:
+            while await reader.read(1024):
+                pass
+        except OSError:
+            pass
+
+        self.subscribers.discard(writer)
+        writer.close()
+
+    def _send(self, writer, line):
+        if writer.transport.get_write_buffer_size() > SUBSCRIBER_BUFFER:
+            self.log.debug("State subscriber not reading, dropped")
+            self.subscribers.discard(writer)
+            writer.close()
+            return
+
+        writer.write(line)
+
+
+class _Fields(dict):
+
+    def __missing__(self, key):
+        return ""
+
+
+def format_state(text, fmt=None):
+    """ Return state JSON `text` as is, or the current server in `fmt`
+
+    Args:
+        text (str): State JSON
+        fmt (str): Format string with song tags, `state`, `artwork`,
+            `color`, `volume` and `server`, e.g. "{artist} - {title}"
+
+    """
+
+    if fmt is None:
+        return text
+
+    state = json.loads(text)
+    server = state["servers"].get(state["server"], {})
+
+    fields = _Fields(server)
+    fields["server"] = state["server"] or ""
+
+    for tag, value in server.get("song", {}).items():
+        fields[tag] = ", ".join(value) if isinstance(value, list) else value
+
+    return fmt.format_map(fields)
+
+
+def print_now(statefile, sockpath, fmt=None, follow=False):
+    """ Print state published by a running daemon, no MPD connection
+
+    Args:
+        statefile (str): Path of the JSON file
+        sockpath (str): Path of the Unix socket, for `follow`
+        fmt (str): Format string, JSON if None
+        follow (bool): Print every change until the daemon quits
+
+    Returns:
+        Exit status
+
+    """
+
+    if not follow:
+        try:
+            with open(path.expanduser(statefile)) as state:
+                print(format_state(state.read(), fmt))
+        except (OSError, ValueError) as err:
+            print("No state: {}".format(err), file=sys.stderr)
+            return 1
+
+        return 0
+
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.connect(path.expanduser(sockpath))
+
+            for line in sock.makefile(encoding="utf-8"):
+                print(format_state(line.strip(), fmt), flush=True)
+
+    except OSError as err:
+        print("No state: {}".format(err), file=sys.stderr)
+        return 1
+    except KeyboardInterrupt:
+        pass
+
+    return 0
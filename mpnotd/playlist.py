@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+
+""" Local mirror of the MPD queue
+"""
+
+import asyncio
+
+from .client import get_songinfo
+
+
+class QueueMirror:
+
+    def __init__(self, log):
+
+        """ QueueMirror
+
+        Keeps the queue in memory, keyed by the playlist version MPD
+        reports in `status`. Only entries changed since the mirrored
+        version are fetched, with plchangesposid for moves and
+        plchanges for new songs, so lookahead never costs a query.
+
+        Args:
+            log (obj): The logger
+
+        """
+
+        self.log = log
+        self.lock = asyncio.Lock()
+        self.version = None
+        self.songs = []
+        self.ids = {}
+
+    def reset(self):
+
+        """ Forget the mirror, the next sync reloads the whole queue
+
+        Needed after reconnecting, a restarted MPD counts versions
+        from the start again
+        """
+
+        self.version = None
+        self.songs = []
+        self.ids = {}
+
+    async def sync(self, client, status=None):
+
+        """ Bring the mirror up to the playlist version in `status`
+
+        Args:
+            client (obj): MPD client or connection
+            status (dict): Player status, queried if None
+
+        """
+
+        async with self.lock:
+            if status is None:
+                status = await client.status()
+
+            version = int(status.get("playlist", 0))
+            length = int(status.get("playlistlength", 0))
+
+            if version == self.version:
+                return
+
+            if self.version is not None:
+                changes = await client.plchangesposid(self.version)
+
+                # New songs need tags, moved ones are already known
+                if any(change["id"] not in self.ids for change in changes):
+                    changes = await client.plchanges(self.version)
+                    moved = [dict(song, cpos=song["pos"]) for song in changes]
+                else:
+                    moved = [dict(self.ids[change["id"]], cpos=change["cpos"])
+                             for change in changes]
+
+                if self._apply(moved, length):
+                    self.log.debug("Queue changed: {} songs".format(
+                        len(moved)))
+                else:
+                    self.log.warning("Queue mirror out of sync, reloading")
+                    self.reset()
+
+            if self.version is None:
+                self.songs = await client.playlistinfo()
+                self.log.debug("Queue loaded: {} songs".format(
+                    len(self.songs)))
+
+            self.version = version
+            self.ids = {song["id"]: song for song in self.songs}
+
+    def _apply(self, changes, length):
+
+        """ Apply `changes` to the mirror, False if it has gaps now
+        """
+
+        # Entries past the new length were removed
+        del self.songs[length:]
+
+        for change in changes:
+            pos = int(change.pop("cpos"))
+            song = dict(change, pos=str(pos))
+
+            if pos < len(self.songs):
+                self.songs[pos] = song
+            else:
+                self.songs.extend([None] * (pos - len(self.songs)))
+                self.songs.append(song)
+
+        # A gap means the deltas did not add up
+        return None not in self.songs
+
+    async def upcoming(self, client, status, depth):
+
+        """ Return list of up to `depth` song dicts that play next
+
+        Follows queue order from `nextsong`, wrapping around when
+        repeat is on. In random mode only the next song is known.
+        """
+
+        if depth < 1 or "nextsong" not in status:
+            return []
+
+        await self.sync(client, status)
+
+        start = int(status["nextsong"])
+        end = start + (1 if status.get("random") == "1" else depth)
+
+        songs = self.songs[start:end]
+
+        # Wrap to the top of the queue
+        if end > len(self.songs) and status.get("repeat") == "1":
+            songs += self.songs[:min(end - len(self.songs), start)]
+
+        return [get_songinfo(song) for song in songs]
@@ -0,0 +1,230 @@
+# -*- coding: utf-8 -*-
+
+""" User plugins run on player events
+"""
+
+import asyncio
+import importlib.util
+import queue
+import threading
+from concurrent.futures import Executor, Future
+from functools import partial
+from os import listdir, path
+
+from .metrics import METRICS
+
+# Hook functions a plugin module may define, each called with an event dict
+HOOKS = ("on_song", "on_state", "on_output", "on_update")
+
+
+class PluginManager:
+
+    def __init__(self, plugdir, log, workers=2, timeout=5):
+
+        """ PluginManager
+
+        Every `*.py` file in `plugdir` is a plugin, hooks are module
+        level functions named after HOOKS. Hooks run in a small
+        thread pool and are never awaited by the idle loop. Hooks of
+        one plugin run one at a time, in the order of the events. A
+        hook still running after `timeout` is given up on, and that
+        plugin is skipped until it returns, so a hung plugin holds at
+        most one worker. Workers are daemon threads, a hook that
+        never returns does not hold up exit.
+
+        Args:
+            plugdir (str): Directory to load plugins from
+            log (obj): The logger
+            workers (int): Number of plugin threads
+            timeout (float): Seconds a hook may take
+
+        """
+
+        self.plugdir = plugdir
+        self.log = log
+        self.timeout = float(timeout)
+        self.plugins = {}
+        self.locks = {}
+        self.hung = set()
+        self.pool = DaemonPool(max(int(workers), 1), "plugin")
+
+    def load(self):
+
+        """ Import plugins, a broken one is logged and left out
+        """
+
+        if not path.isdir(self.plugdir):
+            return
+
+        for filename in sorted(listdir(self.plugdir)):
+            name, ext = path.splitext(filename)
+
+            if ext != ".py" or name.startswith("_"):
+                continue
+
+            spec = importlib.util.spec_from_file_location(
+                "mpnotd_plugin_{}".format(name),
+                path.join(self.plugdir, filename))
+            module = importlib.util.module_from_spec(spec)
+
+            try:
+                spec.loader.exec_module(module)
+            except Exception:
+                METRICS.count("plugin_error")
+                self.log.exception("Plugin {} not loaded".format(name))
+                continue
+
+            hooks = {hook: getattr(module, hook) for hook in HOOKS
+                     if callable(getattr(module, hook, None))}
+
+            if hooks:
+                self.plugins[name] = hooks
+                self.log.debug("Plugin {}: {}".format(
+                    name, ", ".join(hooks)))
+
+    def hooked(self, hook):
+
+        """ Return True if any plugin defines `hook`
+        """
+
+        return any(hook in hooks for hooks in self.plugins.values())
+
+    async def emit(self, hook, event):
+
+        """ Call `hook` of every plugin with `event`, concurrently
+        """
+
+        await asyncio.gather(*(
+            self._call(name, hooks[hook], event)
+            for name, hooks in self.plugins.items() if hook in hooks))
+
+    def close(self):
+
+        """ Stop taking hooks, running ones are not waited for
+        """
+
+        self.pool.shutdown(wait=False, cancel_futures=True)
+
+    async def _call(self, name, func, event):
+
+        lock = self.locks.get(name)
+        if lock is None:
+            lock = self.locks[name] = asyncio.Lock()
+
+        # Waits for earlier hooks of this plugin, in order
+        async with lock:
+
+            # Still stuck in a hook that timed out, drop this one
+            if name in self.hung:
+                METRICS.count("plugin_skipped")
+                self.log.debug("Plugin {} hung, skipped".format(name))
+                return
+
+            loop = asyncio.get_running_loop()
+            future = loop.run_in_executor(
+                self.pool, partial(self._run, name, func, dict(event)))
+            future.add_done_callback(partial(self._done, name))
+
+            try:
+                await asyncio.wait_for(asyncio.shield(future), self.timeout)
+            except asyncio.TimeoutError:
+                METRICS.count("plugin_timeout")
+                self.log.warning("Plugin {} timed out in {}".format(
+                    name, func.__name__))
+
+                if not future.done():
+                    self.hung.add(name)
+            except Exception:
+                # Logged by _done()
+                pass
+
+    def _run(self, name, func, event):
+        with METRICS.timer("plugin:{}".format(name)):
+            func(event)
+
+    def _done(self, name, future):
+        self.hung.discard(name)
+
+        if not future.cancelled() and future.exception() is not None:
+            METRICS.count("plugin_error")
+            self.log.error("Plugin {} failed".format(name),
+                           exc_info=future.exception())
+
+
+class DaemonPool(Executor):
+
+    def __init__(self, workers, name):
+
+        """ DaemonPool
+
+        Thread pool for hooks. ThreadPoolExecutor threads are joined
+        at interpreter exit, so a hung hook would block Ctrl-C and
+        shutdown until it returns. These are daemon threads and are
+        left behind instead.
+
+        Args:
+            workers (int): Number of threads
+            name (str): Thread name prefix
+
+        """
+
+        self.jobs = queue.SimpleQueue()
+        self.closed = False
+        self.threads = [
+            threading.Thread(target=self._work,
+                             name="{}_{}".format(name, num),
+                             daemon=True)
+            for num in range(workers)
+        ]
+
+        for thread in self.threads:
+            thread.start()
+
+    def submit(self, fn, *args, **kwargs):
+        if self.closed:
+            raise RuntimeError("Pool is shut down")
+
+        future = Future()
+        self.jobs.put((future, partial(fn, *args, **kwargs)))
+
+        return future
+
+    def shutdown(self, wait=True, *, cancel_futures=False):
+        self.closed = True
+
+        if cancel_futures:
+            while True:
+                try:
+                    job = self.jobs.get_nowait()
+                except queue.Empty:
+                    break
+
+                if job is not None:
+                    job[0].cancel()
+
+        # One stop marker per thread, after queued jobs
+        for _ in self.threads:
+            self.jobs.put(None)
+
+        if wait:
+            for thread in self.threads:
+                thread.join()
+
+    def _work(self):
+        while True:
+            job = self.jobs.get()
+
+            if job is None:
+                return
+
+            future, func = job
+
+            if not future.set_running_or_notify_cancel():
+                continue
+
+            try:
+                result = func()
+            except BaseException as err:
+                future.set_exception(err)
+            else:
+                future.set_result(result)
@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+
+""" Warm artwork caches for upcoming songs
+"""
+
+import asyncio
+from collections import OrderedDict
+
+from .metrics import METRICS
+
+
+class Prefetcher:
+
+    def __init__(self, warm, log, depth=3, remember=256):
+
+        """ Prefetcher
+
+        A single background worker drains a bounded queue, so
+        prefetching never competes with itself for CPU or disk
+
+        Args:
+            warm (callable): Blocking function called with a song dict
+            log (obj): The logger
+            depth (int): Number of upcoming songs to warm
+            remember (int): Number of warmed albums to skip
+
+        """
+
+        self.warm = warm
+        self.log = log
+        self.depth = int(depth)
+        self.remember = remember
+        self.queue = asyncio.Queue(maxsize=max(self.depth, 1))
+        self.warmed = OrderedDict()
+        self.worker = None
+
+    def start(self):
+
+        """ Start background worker
+        """
+
+        if self.worker is None and self.depth > 0:
+            self.worker = asyncio.ensure_future(self._run())
+
+    def stop(self):
+
+        """ Stop background worker
+        """
+
+        if self.worker is not None:
+            self.worker.cancel()
+            self.worker = None
+
+    def schedule(self, songs):
+
+        """ Replace pending work with `songs`, nearest first
+        """
+
+        # Drop the stale window, the queue only moves forward
+        while not self.queue.empty():
+            self.queue.get_nowait()
+            self.queue.task_done()
+
+        pending = set()
+
+        for song in songs[:self.depth]:
+            key = self._key(song)
+
+            if key in self.warmed or key in pending:
+                continue
+
+            try:
+                self.queue.put_nowait(song)
+            except asyncio.QueueFull:
+                break
+
+            pending.add(key)
+            self.log.debug("Prefetch queued: {}".format(song["file"]))
+
+    async def _run(self):
+
+        loop = asyncio.get_running_loop()
+
+        while True:
+            song = await self.queue.get()
+
+            try:
+                await loop.run_in_executor(None, self.warm, song)
+                self._remember(self._key(song))
+            except Exception:
+                METRICS.count("prefetch_error")
+                self.log.exception("Prefetch failed: {}".format(song["file"]))
+            finally:
+                self.queue.task_done()
+
+    def _remember(self, key):
+
+        self.warmed[key] = True
+        self.warmed.move_to_end(key)
+
+        while len(self.warmed) > self.remember:
+            self.warmed.popitem(last=False)
+
+    @staticmethod
+    def _key(song):
+        return (song["artist"], song["album"])
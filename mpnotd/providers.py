@@ -0,0 +1,439 @@
+# -*- coding: utf-8 -*-
+
+""" Remote artwork providers
+"""
+
+import http.client
+import json
+import multiprocessing
+import threading
+import time
+from urllib.parse import quote, urlencode, urljoin, urlsplit
+
+from .cache import artwork_key
+from .metrics import METRICS
+
+USER_AGENT = "mpnotd/0.2 ( https://github.com/jeffmhubbard/mpnotd )"
+
+# Largest response body accepted, in bytes
+MAX_BODY = 16 << 20
+
+# Statuses followed to another URL, and meaning there is no artwork
+REDIRECTS = (301, 302, 303, 307, 308)
+MISSES = (404, 410)
+
+
+class RemoteUnavailable(Exception):
+
+    """ No provider had artwork and at least one could not be asked
+    """
+
+
+class HTTPPool:
+
+    def __init__(self, timeout=5, limit=2):
+
+        """ HTTPPool
+
+        Keeps idle keep-alive connections per host, so repeated
+        requests to a provider skip connection and TLS setup
+
+        Args:
+            timeout (float): Seconds a request may take in total
+            limit (int): Number of requests running at once
+
+        """
+
+        self.timeout = float(timeout)
+        self.slots = threading.BoundedSemaphore(max(int(limit), 1))
+        self.lock = threading.Lock()
+        self.idle = {}
+
+    def get(self, url, headers=None, redirects=3):
+
+        """ GET `url`, following redirects
+
+        Returns:
+            Tuple of status, content type and body
+
+        Raises:
+            OSError, http.client.HTTPException: Request failed or took
+                longer than `timeout`
+
+        """
+
+        with self.slots:
+            deadline = time.monotonic() + self.timeout
+
+            for _ in range(redirects + 1):
+                status, ctype, location, body = self._request(
+                    url, headers, deadline)
+
+                if status not in REDIRECTS or not location:
+                    return status, ctype, body
+
+                url = urljoin(url, location)
+
+        raise http.client.HTTPException("Too many redirects: {}".format(url))
+
+    def close(self):
+
+        """ Close idle connections
+        """
+
+        with self.lock:
+            for conns in self.idle.values():
+                for conn in conns:
+                    conn.close()
+            self.idle = {}
+
+    def _request(self, url, headers, deadline):
+        parts = urlsplit(url)
+        key = (parts.scheme, parts.netloc)
+        target = parts.path or "/"
+        if parts.query:
+            target += "?" + parts.query
+        headers = dict({"User-Agent": USER_AGENT}, **(headers or {}))
+
+        for attempt in (0, 1):
+            conn, reused = self._checkout(key, deadline)
+
+            try:
+                self._limit(conn, deadline)
+                conn.request("GET", target, headers=headers)
+                self._limit(conn, deadline)
+                response = conn.getresponse()
+                body = self._read(conn, response, deadline)
+
+            # A kept connection may have been closed by the server
+            except (http.client.RemoteDisconnected, BrokenPipeError,
+                    ConnectionResetError):
+                conn.close()
+                if reused and not attempt:
+                    continue
+                raise
+
+            except (OSError, http.client.HTTPException):
+                conn.close()
+                raise
+
+            if response.will_close:
+                conn.close()
+            else:
+                self._checkin(key, conn)
+
+            return (response.status,
+                    response.getheader("Content-Type", ""),
+                    response.getheader("Location"),
+                    body)
+
+    def _limit(self, conn, deadline):
+
+        """ Bound the next socket wait of `conn` by `deadline`
+        """
+
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise TimeoutError("Request timed out")
+
+        # Used when connecting, the socket does not exist yet
+        conn.timeout = remaining
+        if conn.sock is not None:
+            conn.sock.settimeout(remaining)
+
+    def _read(self, conn, response, deadline):
+        length = response.getheader("Content-Length")
+
+        if length is not None and int(length) > MAX_BODY:
+            raise http.client.HTTPException("Response too large")
+
+        chunks = []
+        size = 0
+
+        # read1() returns whatever one receive brings, so a server
+        # trickling bytes can not keep a read going past the deadline
+        while True:
+            self._limit(conn, deadline)
+
+            chunk = response.read1(64 * 1024)
+            if not chunk:
+                break
+
+            size += len(chunk)
+            if size > MAX_BODY:
+                raise http.client.HTTPException("Response too large")
+
+            chunks.append(chunk)
+
+        # Unlike read(), read1() leaves the response open at the end,
+        # the connection could not be reused
+        self._limit(conn, deadline)
+        chunks.append(response.read())
+
+        return b"".join(chunks)
+
+    def _checkout(self, key, deadline):
+        with self.lock:
+            conns = self.idle.get(key)
+            if conns:
+                return conns.pop(), True
+
+        scheme, netloc = key
+        connection = (http.client.HTTPSConnection
+                      if scheme == "https" else http.client.HTTPConnection)
+
+        return connection(netloc,
+                          timeout=max(deadline - time.monotonic(), 0.1)), False
+
+    def _checkin(self, key, conn):
+        with self.lock:
+            self.idle.setdefault(key, []).append(conn)
+
+
+class RateLimit:
+
+    def __init__(self, interval):
+
+        """ RateLimit
+
+        Spaces calls at least `interval` seconds apart. Kept in shared
+        memory, so the limit holds across worker processes it is
+        passed to, e.g. by --warm-cache
+
+        Args:
+            interval (float): Min seconds between calls
+
+        """
+
+        self.interval = float(interval)
+        self.lock = multiprocessing.Lock()
+        self.last = multiprocessing.RawValue("d", 0.0)
+
+    def wait(self):
+
+        """ Block until the next call is allowed
+        """
+
+        with self.lock:
+            time.sleep(max(self.last.value + self.interval - time.monotonic(),
+                           0))
+            self.last.value = time.monotonic()
+
+
+class TemplateProvider:
+
+    def __init__(self, template):
+
+        """ TemplateProvider
+
+        Fetches artwork from a URL template, e.g. a local mirror at
+        `http://nas/covers/{artist}/{album}/cover.jpg`
+
+        Args:
+            template (str): URL with `{artist}` and `{album}` fields
+
+        """
+
+        try:
+            template.format(artist="", album="")
+        except (KeyError, IndexError, ValueError):
+            raise ValueError("Bad artwork provider template: {}".format(
+                template))
+
+        self.name = template
+        self.template = template
+
+    def fetch(self, pool, artist, album):
+
+        """ Return (url, data), or None if there is no artwork
+        """
+
+        url = self.template.format(artist=quote(artist, safe=""),
+                                   album=quote(album, safe=""))
+
+        return _image(pool, url)
+
+
+class CoverArtArchive:
+
+    name = "musicbrainz"
+
+    def __init__(self,
+                 search="https://musicbrainz.org/ws/2/",
+                 archive="https://coverartarchive.org/",
+                 size=500,
+                 interval=1.0):
+
+        """ CoverArtArchive
+
+        Looks up the release group on MusicBrainz and fetches its
+        front cover from the Cover Art Archive
+
+        Args:
+            search (str): MusicBrainz web service URL
+            archive (str): Cover Art Archive URL
+            size (int): Cover size, 250, 500 or 1200
+            interval (float): Min seconds between MusicBrainz searches,
+                as their rate limit asks, in every process sharing it
+
+        """
+
+        self.search = search
+        self.archive = archive
+        self.size = size
+        self.limit = RateLimit(interval)
+
+    def fetch(self, pool, artist, album):
+
+        """ Return (url, data), or None if there is no artwork
+        """
+
+        query = 'releasegroup:"{}" AND artist:"{}"'.format(
+            _quoted(album), _quoted(artist))
+        url = "{}release-group/?{}".format(self.search, urlencode(
+            {"query": query, "fmt": "json", "limit": 3}))
+
+        self.limit.wait()
+
+        status, ctype, body = pool.get(url, {"Accept": "application/json"})
+        if status != 200:
+            raise http.client.HTTPException(
+                "MusicBrainz HTTP {}".format(status))
+
+        groups = json.loads(body.decode("utf-8")).get("release-groups", [])
+
+        for group in groups:
+            if int(group.get("score", 0)) < 90:
+                continue
+
+            found = _image(pool, "{}release-group/{}/front-{}".format(
+                self.archive, group["id"], self.size))
+            if found is not None:
+                return found
+
+        return None
+
+
+class RemoteArtwork:
+
+    def __init__(self, providers, index=None, log=None, timeout=5, limit=2):
+
+        """ RemoteArtwork
+
+        Asks providers in order until one has artwork. Albums a
+        provider has no artwork for are kept in `index` and not asked
+        again within its `miss_ttl`, failed requests are not.
+
+        Args:
+            providers (list): Providers, see make_providers()
+            index (obj): ArtworkIndex keeping misses, or None
+            log (obj): The logger
+            timeout (float): Seconds per request
+            limit (int): Number of requests running at once
+
+        """
+
+        self.providers = list(providers)
+        self.index = index
+        self.log = log
+        self.pool = HTTPPool(timeout, limit)
+
+    def __call__(self, artist, album):
+
+        """ Return (url, data) of artwork, or (None, None)
+
+        Raises:
+            RemoteUnavailable: No artwork found, but a provider failed
+
+        """
+
+        if not artist or not album:
+            return None, None
+
+        albumkey = artwork_key(artist, album)
+        failed = False
+
+        for provider in self.providers:
+            if self.index is not None and self.index.remote_missed(
+                    provider.name, albumkey):
+                METRICS.count("remote_known_miss")
+                continue
+
+            try:
+                found = provider.fetch(self.pool, artist, album)
+            except (OSError, ValueError, http.client.HTTPException) as err:
+                METRICS.count("remote_error")
+                self.log.debug("{} failed: {}".format(provider.name, err))
+                failed = True
+                continue
+
+            if found is not None:
+                self.log.debug("Remote image found: {}".format(found[0]))
+                return found
+
+            METRICS.count("remote_miss")
+            if self.index is not None:
+                self.index.store_remote_miss(provider.name, albumkey)
+
+        if failed:
+            raise RemoteUnavailable("{} - {}".format(artist, album))
+
+        return None, None
+
+    def close(self):
+        self.pool.close()
+
+
+def make_providers(specs):
+    """Return providers for the comma separated config entry `specs`
+
+    Raises:
+        ValueError: An entry is not a provider
+
+    """
+
+    return [make_provider(spec.strip()) for spec in str(specs).split(",")
+            if spec.strip()]
+
+
+def make_provider(spec):
+    """Return provider for a config entry
+
+    Args:
+        spec (str): `musicbrainz`, or a URL template with `{artist}`
+            and `{album}` fields
+
+    Raises:
+        ValueError: `spec` is not a provider
+
+    """
+
+    if spec == CoverArtArchive.name:
+        return CoverArtArchive()
+
+    if "://" in spec:
+        return TemplateProvider(spec)
+
+    raise ValueError("Unknown artwork provider: {}".format(spec))
+
+
+def _image(pool, url):
+    """ Return (url, data) if `url` is an image, None if it is missing
+    """
+
+    status, ctype, body = pool.get(url)
+
+    if status == 200 and ctype.startswith("image/") and body:
+        return url, body
+
+    if status in MISSES or status == 200:
+        return None
+
+    raise http.client.HTTPException("HTTP {} for {}".format(status, url))
+
+
+def _quoted(text):
+    """ Escape `text` for a quoted Lucene phrase
+    """
+
+    return text.replace("\\", "\\\\").replace('"', '\\"')
@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+
+""" Status snapshots, field deltas and popup rate limiting
+"""
+
+import asyncio
+
+# Fields changing with every call, never dispatched
+VOLATILE = ("elapsed", "time", "duration")
+
+
+class StatusTracker:
+
+    def __init__(self):
+
+        """ StatusTracker
+
+        Keeps the last `status` and `outputs` of a server, outputs
+        keyed by `outputid`, and returns what changed between calls
+        """
+
+        self.status = {}
+        self.outputs = {}
+
+    def update(self, status):
+
+        """ Store `status`, return changed fields
+
+        Returns:
+            Dict of field name to (old, new), None where a field is
+            missing, e.g. `updating_db` once an update is done
+
+        """
+
+        old = self.status
+        self.status = status
+
+        return {
+            key: (old.get(key), status.get(key))
+            for key in set(old) | set(status)
+            if key not in VOLATILE and old.get(key) != status.get(key)
+        }
+
+    def update_outputs(self, outputs):
+
+        """ Store `outputs`, return changed outputs
+
+        Returns:
+            List of (outputid, old, new) output dicts, `old` is None
+            for added outputs and `new` for removed ones
+
+        """
+
+        old = self.outputs
+        self.outputs = {output["outputid"]: output for output in outputs}
+
+        return [(outputid, old.get(outputid), self.outputs.get(outputid))
+                for outputid in sorted(set(old) | set(self.outputs), key=int)
+                if old.get(outputid) != self.outputs.get(outputid)]
+
+
+class PopupLimiter:
+
+    def __init__(self, show, interval=1.0):
+
+        """ PopupLimiter
+
+        Shows at most one popup per key and `interval`. Popups coming
+        in faster are coalesced, the latest one is shown once the
+        interval is over, e.g. the final volume of a slider drag.
+
+        Args:
+            show (callable): Called with the popup keyword arguments
+            interval (float): Min seconds between popups of one key
+
+        """
+
+        self.show = show
+        self.interval = float(interval)
+        self.last = {}
+        self.pending = {}
+
+    def submit(self, key, **data):
+
+        """ Show popup `data` for `key` now, or once allowed
+        """
+
+        loop = asyncio.get_running_loop()
+        wait = self.last.get(key, float("-inf")) + self.interval - loop.time()
+
+        if key in self.pending or wait > 0:
+            if key not in self.pending:
+                loop.call_later(wait, self._flush, key)
+            self.pending[key] = data
+            return
+
+        self.last[key] = loop.time()
+        self.show(**data)
+
+    def _flush(self, key):
+        data = self.pending.pop(key, None)
+
+        if data is not None:
+            self.last[key] = asyncio.get_running_loop().time()
+            self.show(**data)
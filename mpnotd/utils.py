@@ -9,8 +9,7 @@ import logging
 import re
 import string
 import sys
-import time
-from os import listdir, makedirs, path, remove
+from os import makedirs, path
 
 
 def read_args(name, desc):
@@ -30,6 +29,28 @@ def read_args(name, desc):
                      action="store_true",
                      help="write config file and quit")
 
+    # warm artwork cache
+    group.add_argument("--warm-cache",
+                       action="store_true",
+                       help="cache artwork of the whole library and quit")
+    group.add_argument("--jobs",
+                       type=int,
+                       default=None,
+                       help="worker processes for --warm-cache")
+
+    # print state published by a running daemon
+    now = parser.add_argument_group("now playing:")
+    now.add_argument("--now",
+                     action="store_true",
+                     help="print what the daemon is playing and quit")
+    now.add_argument("--format",
+                     default=None,
+                     help="format for --now, e.g. \"{artist} - {title}\", "
+                     "JSON if not given")
+    now.add_argument("--follow",
+                     action="store_true",
+                     help="with --now, print every change until interrupted")
+
     return parser.parse_args(sys.argv[1:])
 
 
@@ -37,13 +58,17 @@ def load_config(name, inifile, defaults):
     """Load user config
     """
 
-    config = {}
+    config = dict(defaults)
 
     # Override from user config
     if path.exists(inifile):
         uconf = configparser.ConfigParser(defaults)
         uconf.read(inifile)
 
+        # Only server sections, the main config is all defaults
+        if not uconf.has_section(name):
+            return config
+
         # All keys are required for valid config
         for cvar in defaults.keys():
             config[cvar] = uconf.get(name, cvar)
@@ -51,6 +76,51 @@ def load_config(name, inifile, defaults):
     return config
 
 
+def load_servers(name, inifile, config):
+    """Load MPD server sections
+
+    Sections named `[name:label]` start from `config` and override
+    any of its keys, e.g. `host`, `port`, `auth` or `music`. The main
+    section is watched as well if it sets `host` itself, unless a
+    server section points at the same host and port.
+
+    Args:
+        name (str): Main section name
+        inifile (str): Path to config file
+        config (dict): Loaded main config
+
+    Returns:
+        List of (label, config) tuples, only `config` labelled by its
+        host if there are no server sections or it sets `host`
+
+    """
+
+    servers = []
+    prefix = "{}:".format(name)
+
+    if path.exists(inifile):
+        uconf = configparser.ConfigParser()
+        uconf.read(inifile)
+
+        for section in uconf.sections():
+            if not section.startswith(prefix):
+                continue
+
+            server = dict(config)
+            server.update((key, value) for key, value in uconf.items(section)
+                          if key in config)
+            servers.append((section[len(prefix):].strip(), server))
+
+        main = (str(config["host"]), str(config["port"]))
+
+        if uconf.has_option(name, "host") and main not in [
+                (str(server["host"]), str(server["port"]))
+                for label, server in servers]:
+            servers.insert(0, (config["host"], config))
+
+    return servers or [(config["host"], config)]
+
+
 def write_config(name, inifile, defaults):
     """Write config file with defaults
     """
@@ -123,26 +193,3 @@ def _makedirs(dest):
         except OSError as md_error:
             if md_error.errno != errno.EEXIST:
                 raise
-
-
-def clean_cache(cachedir, log, limit=100):
-    """Remove cached images
-
-    Args:
-        cachedir (str): Path to image cache
-        log (obj): Logger for debug
-        limit (int): Number of hours to keep cached image
-
-    """
-
-    limit *= 3600
-
-    use_by = time.time() - limit
-    log.debug("Cache Age: {}".format(use_by))
-
-    for filename in listdir(cachedir):
-        filepath = path.join(cachedir, filename)
-
-        if filepath.endswith(".png") and path.getatime(filepath) < use_by:
-            log.debug("Removing: {}".format(filepath))
-            remove(path.join(filepath))
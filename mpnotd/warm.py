@@ -0,0 +1,266 @@
+# -*- coding: utf-8 -*-
+
+""" Warm the artwork cache for a whole library
+"""
+
+import logging
+import multiprocessing
+import sys
+import time
+from os import path, walk
+
+from mpd import CommandError, MPDClient, MPDError
+
+from .artwork import cache_artwork
+from .cache import thumb_files
+from .client import get_songinfo
+from .index import ArtworkIndex
+from .providers import RemoteArtwork
+
+# Audio file extensions considered when walking the music dir
+AUDIO_EXTS = (".flac", ".mp3", ".ogg", ".opus", ".m4a", ".wav", ".wv",
+              ".ape", ".mpc", ".aiff")
+
+# Per worker process state, set by _init_worker()
+_WORKER = {}
+
+
+def warm_cache(cachedir, config, log, index, cache, sizes, fmt, jobs=None,
+               providers=()):
+    """Resolve and thumbnail artwork of every album in the library
+
+    Albums are listed with MPD `lsinfo`, one directory at a time, or
+    by walking `music` if MPD can not be reached. Albums already in `index`, hits and
+    known misses, are skipped, so an interrupted run resumes where it
+    stopped.
+
+    Args:
+        cachedir (str): Path to cached artwork
+        config (dict): Server config, `host`, `port`, `auth`, `music`
+            and `mpd_art`
+        log (obj): The logger
+        index (obj): ArtworkIndex of known hits and misses
+        cache (obj): CacheManager, new thumbnails are added to it
+        sizes (list): Thumbnail sizes in pixels
+        fmt (str): Thumbnail format, png, jpeg or webp
+        jobs (int): Worker processes, None for one per CPU
+        providers (list): Web artwork providers, see make_providers().
+            Workers share them, and with them the MusicBrainz rate
+            limit
+
+    Returns:
+        Tuple of found, missing and failed album counts
+
+    """
+
+    musicdir = path.expanduser(config["music"])
+
+    try:
+        albums = list_albums(config)
+    except (MPDError, OSError) as mpd_err:
+        log.warning("MPD listing failed, walking music dir: {}".format(
+            mpd_err))
+        albums = walk_albums(musicdir)
+
+    todo = [album for album in albums if not index.lookup(*album[:3])[0]]
+
+    _progress("{} albums, {} cached, {} to warm\n".format(
+        len(albums), len(albums) - len(todo), len(todo)))
+
+    found = missing = failed = 0
+
+    if not todo:
+        return found, missing, failed
+
+    mpdart = config if int(config["mpd_art"]) > 0 else None
+    remote = (list(providers), config["http_timeout"], config["http_workers"])
+    start = time.monotonic()
+
+    with multiprocessing.Pool(jobs, _init_worker,
+                              (cachedir, musicdir, index.dbfile,
+                               index.miss_ttl, sizes, fmt, mpdart,
+                               remote)) as pool:
+
+        for num, (album, thumb, err) in enumerate(
+                pool.imap_unordered(_warm_album, todo), 1):
+
+            if err is not None:
+                failed += 1
+                log.warning("Warming {} failed: {}".format(album[0], err))
+            elif thumb is None:
+                missing += 1
+            else:
+                found += 1
+                cache.add(thumb, sum(
+                    path.getsize(size) for size in thumb_files(thumb)))
+
+            rate = num / max(time.monotonic() - start, 1e-3)
+            _progress("\r[{}/{}] {:.1f}/s {} found, {} missing, {} failed"
+                      .format(num, len(todo), rate, found, missing, failed))
+
+    _progress("\n")
+
+    return found, missing, failed
+
+
+def list_albums(config):
+    """Return (albumdir, artist, album, file) for each album MPD knows
+
+    One entry per directory, artist and album, keyed like songs
+    on the popup path. Directories are listed one `lsinfo` at a time,
+    `listallinfo` would overflow MPD's output buffer on a large
+    library and drop the connection.
+    """
+
+    client = _connect(config)
+    albums = {}
+    dirs = [""]
+
+    try:
+        while dirs:
+            for entry in client.lsinfo(dirs.pop()):
+                if "directory" in entry:
+                    dirs.append(entry["directory"])
+                    continue
+
+                if "file" not in entry:
+                    continue
+
+                info = get_songinfo(entry)
+
+                if not info["artist"] or not info["album"]:
+                    continue
+
+                albumdir = path.dirname(info["file"])
+                albums.setdefault((albumdir, info["artist"], info["album"]),
+                                  info["file"])
+    finally:
+        client.disconnect()
+
+    return [key + (url, ) for key, url in albums.items()]
+
+
+def walk_albums(musicdir):
+    """Return (albumdir, artist, album, file) for each music dir album
+
+    Artist and album are guessed from `Artist/Album/` directory names
+    """
+
+    albums = []
+
+    for root, dirs, files in walk(musicdir):
+        dirs.sort()
+        songs = sorted(name for name in files
+                       if name.lower().endswith(AUDIO_EXTS))
+
+        if not songs:
+            continue
+
+        albumdir = path.relpath(root, musicdir)
+        artist, album = path.split(albumdir)
+
+        if artist and album:
+            albums.append((albumdir, path.basename(artist), album,
+                           path.join(albumdir, songs[0])))
+
+    return albums
+
+
+def _warm_album(job):
+
+    """ Resolve artwork of one album in a worker process
+    """
+
+    albumdir, artist, album, url = job
+
+    try:
+        thumb = cache_artwork(
+            _WORKER["cachedir"],
+            _WORKER["musicdir"],
+            _WORKER["log"],
+            url,
+            artist,
+            album,
+            _WORKER["index"],
+            None,
+            _WORKER["sizes"],
+            _WORKER["fmt"],
+            _WORKER["mpdart"],
+            _WORKER["remote"],
+        )
+    except Exception as err:
+        return job, None, "{}: {}".format(type(err).__name__, err)
+
+    return job, thumb, None
+
+
+def _init_worker(cachedir, musicdir, dbfile, miss_ttl, sizes, fmt, mpdconfig,
+                 remote):
+
+    log = logging.getLogger()
+    index = ArtworkIndex(dbfile, miss_ttl)
+    providers, timeout, limit = remote
+
+    # Every worker has its own index, MPD and HTTP connections
+    _WORKER.update({
+        "cachedir": cachedir,
+        "musicdir": musicdir,
+        "log": log,
+        "index": index,
+        "sizes": sizes,
+        "fmt": fmt,
+        "mpdart": None,
+        "remote": None,
+    })
+
+    if providers:
+        _WORKER["remote"] = RemoteArtwork(providers, index, log, timeout,
+                                          limit)
+
+    if mpdconfig is not None:
+        _WORKER["mpdconfig"] = mpdconfig
+        _WORKER["mpdart"] = _mpd_artwork
+
+
+def _mpd_artwork(url):
+
+    """ Return (source, data) of artwork MPD has for `url`
+    """
+
+    client = _WORKER.get("mpdclient")
+
+    try:
+        if client is None:
+            client = _WORKER["mpdclient"] = _connect(_WORKER["mpdconfig"])
+
+        for command in ("albumart", "readpicture"):
+            try:
+                response = getattr(client, command)(url)
+            except CommandError:
+                continue
+
+            if response.get("binary"):
+                return "mpd:{}:{}".format(command, url), response["binary"]
+
+    except (MPDError, OSError) as mpd_err:
+        _WORKER["log"].debug("MPD artwork failed: {}".format(mpd_err))
+        _WORKER.pop("mpdclient", None)
+
+    return None, None
+
+
+def _connect(config):
+
+    client = MPDClient()
+    client.timeout = 30
+    client.connect(config["host"], config["port"])
+
+    if config["auth"] != "":
+        client.password(config["auth"])
+
+    return client
+
+
+def _progress(text):
+    sys.stdout.write(text)
+    sys.stdout.flush()
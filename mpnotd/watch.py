@@ -0,0 +1,283 @@
+# -*- coding: utf-8 -*-
+
+""" Invalidate artwork when images in album directories change
+"""
+
+import asyncio
+import ctypes
+import ctypes.util
+import errno
+import os
+import struct
+import threading
+from os import path
+
+from .cache import artwork_key
+
+# Files find_image() considers
+IMAGE_EXTS = (".png", ".jpg", ".jpeg")
+
+# inotify(7) constants
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = os.O_CLOEXEC
+
+WATCH_MASK = (IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_DELETE
+              | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR)
+SELF_MASK = IN_DELETE_SELF | IN_MOVE_SELF | IN_IGNORED
+
+EVENT = struct.Struct("iIII")
+
+# statfs(2) f_type of network filesystems, inotify does not see changes
+# made on other hosts
+NETWORK_FS = {
+    0x00006969,  # NFS_SUPER_MAGIC
+    0x0000517B,  # SMB_SUPER_MAGIC
+    0xFF534D42,  # CIFS_MAGIC_NUMBER
+    0xFE534D42,  # SMB2_MAGIC_NUMBER
+    0x00C36400,  # CEPH_SUPER_MAGIC
+    0x01021997,  # V9FS_MAGIC
+    0x5346414F,  # AFS_SUPER_MAGIC
+    0x65735546,  # FUSE_SUPER_MAGIC, e.g. sshfs
+}
+
+# Bytes of struct statfs, f_type comes first
+STATFS_SIZE = 256
+
+
+class MusicWatcher:
+
+    def __init__(self, musicdir, index, log, mode=1, interval=300):
+
+        """ MusicWatcher
+
+        Watches album directories the index knows about and forgets
+        their artwork when an image in them is added, replaced or
+        removed, so cached hits and misses never need to check the
+        filesystem. Uses inotify, directories it can not watch or
+        that are on a network filesystem are compared by image names,
+        sizes and mtimes every `interval`.
+
+        Args:
+            musicdir (str): Path to music directory
+            index (obj): ArtworkIndex to invalidate
+            log (obj): The logger
+            mode (int): 1 inotify with polling fallback, 2 polling
+            interval (int): Seconds between polls
+
+        """
+
+        self.musicdir = musicdir
+        self.index = index
+        self.log = log
+        self.mode = int(mode)
+        self.interval = float(interval)
+
+        self.lock = threading.Lock()
+        self.dirs = {}
+        self.wds = {}
+        self.fd = None
+        self.libc = None
+        self.loop = None
+        self.full = False
+        self.remote = False
+
+    async def run(self, refresh=60):
+
+        """ Watch until cancelled
+
+        Args:
+            refresh (int): Seconds between picking up new album dirs
+
+        """
+
+        self.loop = asyncio.get_running_loop()
+
+        if self.mode == 1:
+            self._start_inotify()
+
+        elapsed = 0
+
+        try:
+            while True:
+                await self.loop.run_in_executor(None, self.refresh)
+
+                if elapsed >= self.interval:
+                    elapsed = 0
+                    await self.loop.run_in_executor(None, self.poll)
+
+                await asyncio.sleep(refresh)
+                elapsed += refresh
+        finally:
+            self.close()
+
+    def refresh(self):
+
+        """ Start watching album dirs added to the index
+        """
+
+        with self.lock:
+            new = self.index.album_dirs() - set(self.dirs)
+
+            for albumdir in new:
+                self.dirs[albumdir] = self._signature(albumdir)
+
+                if self.fd is not None:
+                    self._add_watch(albumdir)
+
+        if new:
+            self.log.debug("Watching {} album dirs".format(len(self.dirs)))
+
+    def poll(self, everything=False):
+
+        """ Forget artwork of dirs whose images changed since last poll
+
+        Dirs watched by inotify are skipped unless `everything` is set
+        """
+
+        with self.lock:
+            watched = set(self.wds.values())
+            polled = [(albumdir, signature)
+                      for albumdir, signature in self.dirs.items()
+                      if everything or albumdir not in watched]
+
+        for albumdir, signature in polled:
+            if self._signature(albumdir) != signature:
+                self.invalidate(albumdir)
+
+    def invalidate(self, albumdir):
+
+        """ Forget artwork and misses of an album dir
+
+        The dir is watched again once the index knows it again
+        """
+
+        with self.lock:
+            self.dirs.pop(albumdir, None)
+
+        count = self.index.forget_dir(albumdir, artwork_key)
+
+        if count:
+            self.log.debug("Images changed, forgot {} albums in {}".format(
+                count, albumdir))
+
+    def close(self):
+
+        """ Stop watching
+        """
+
+        if self.fd is not None:
+            if self.loop is not None:
+                self.loop.remove_reader(self.fd)
+            os.close(self.fd)
+            self.fd = None
+            self.wds = {}
+
+    def _signature(self, albumdir):
+        try:
+            with os.scandir(path.join(self.musicdir, albumdir)) as entries:
+                return sorted((entry.name, entry.stat().st_mtime_ns,
+                               entry.stat().st_size) for entry in entries
+                              if entry.name.lower().endswith(IMAGE_EXTS))
+        except OSError:
+            return None
+
+    # inotify
+
+    def _start_inotify(self):
+        try:
+            self.libc = ctypes.CDLL(ctypes.util.find_library("c"),
+                                    use_errno=True)
+            fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        except (OSError, AttributeError) as err:
+            self.log.warning("inotify unavailable, polling: {}".format(err))
+            return
+
+        if fd < 0:
+            self.log.warning("inotify unavailable, polling: {}".format(
+                os.strerror(ctypes.get_errno())))
+            return
+
+        self.fd = fd
+        self.loop.add_reader(fd, self._read_events)
+
+    def _add_watch(self, albumdir):
+        dirpath = os.fsencode(path.join(self.musicdir, albumdir))
+
+        # Watches on NFS or CIFS work, but only see changes made here
+        if self._network_fs(dirpath):
+            if not self.remote:
+                self.log.debug("Network filesystem, polling album dirs")
+            self.remote = True
+            return
+
+        wd = self.libc.inotify_add_watch(self.fd, dirpath, WATCH_MASK)
+
+        if wd >= 0:
+            self.wds[wd] = albumdir
+            return
+
+        err = ctypes.get_errno()
+
+        # Out of watches, the dir is polled instead
+        if err == errno.ENOSPC:
+            if not self.full:
+                self.log.warning("inotify watch limit reached, polling")
+            self.full = True
+        elif err != errno.ENOENT:
+            self.log.debug("inotify watch failed: {}".format(
+                os.strerror(err)))
+
+    def _network_fs(self, dirpath):
+        buf = ctypes.create_string_buffer(STATFS_SIZE)
+
+        if self.libc.statfs(dirpath, buf) != 0:
+            return False
+
+        f_type = ctypes.c_long.from_buffer(buf).value & 0xFFFFFFFF
+
+        return f_type in NETWORK_FS
+
+    def _read_events(self):
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return
+
+        changed = set()
+        offset = 0
+
+        while offset < len(data):
+            wd, mask, cookie, length = EVENT.unpack_from(data, offset)
+            name = data[offset + EVENT.size:offset + EVENT.size + length]
+            offset += EVENT.size + length
+
+            # Events were dropped, compare every dir instead
+            if mask & IN_Q_OVERFLOW:
+                self.log.warning("inotify queue overflow, polling")
+                self.loop.run_in_executor(None, self.poll, True)
+                continue
+
+            with self.lock:
+                albumdir = self.wds.get(wd)
+
+                # Dir itself went away
+                if albumdir is not None and mask & SELF_MASK:
+                    self.wds.pop(wd)
+                    changed.add(albumdir)
+                    continue
+
+            name = os.fsdecode(name.rstrip(b"\0"))
+            if albumdir is not None and name.lower().endswith(IMAGE_EXTS):
+                changed.add(albumdir)
+
+        for albumdir in changed:
+            self.invalidate(albumdir)
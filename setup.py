@@ -11,14 +11,11 @@ setup(
     packages=['mpnotd'],
     scripts=['bin/mpnotd'],
     install_requires=[
-        'python-mpd2',
+        'python-mpd2>=3.0,<3.2',
         'notify2',
         'dbus-python',
-        'beautifulsoup4',
-        'bs4',
-        'pillow',
-        'colormath',
-        'colorthief',
+        'pillow>=7.0',
+        'numpy',
     ],
     zip_safe=False,
     include_package_data=True,
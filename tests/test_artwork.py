@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+
+""" Resolving artwork into the thumbnail cache
+"""
+
+import logging
+from os import makedirs, path
+
+from PIL import Image
+
+from mpnotd.artwork import cache_artwork
+from mpnotd.index import ArtworkIndex
+
+LOG = logging.getLogger(__name__)
+
+
+def legacy(cachedir, name):
+    filepath = path.join(cachedir, name)
+    Image.new("RGB", (96, 96), "#336699").save(filepath)
+
+    return filepath
+
+
+def test_legacy_thumb_adopted(tmp_path):
+    cachedir = str(tmp_path / "cache")
+    makedirs(cachedir)
+    old = legacy(cachedir, "cover-the_artist-an_album.png")
+    index = ArtworkIndex(path.join(cachedir, "index.db"))
+
+    thumb = cache_artwork(cachedir, str(tmp_path), LOG, "A/B/01.flac",
+                          "The Artist", "An Album", index,
+                          sizes=(96, 256), fmt="jpeg")
+
+    # Content keyed, every size, the old file is gone
+    assert path.basename(thumb).endswith("-96.jpg")
+    assert path.exists(thumb.replace("-96.jpg", "-256.jpg"))
+    assert not path.exists(old)
+    assert index.lookup("A/B", "The Artist", "An Album") == (True, thumb)
+
+    index.close()
+
+
+def test_lossy_legacy_name_ignored(tmp_path):
+    cachedir = str(tmp_path / "cache")
+    makedirs(cachedir)
+
+    # Both albums had this name, it can not tell them apart
+    old = legacy(cachedir, "cover--.png")
+    index = ArtworkIndex(path.join(cachedir, "index.db"))
+
+    assert cache_artwork(cachedir, str(tmp_path), LOG, "A/B/01.flac",
+                         "ア", "ベ", index) is None
+    assert path.exists(old)
+
+    index.close()
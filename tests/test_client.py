@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+
+""" Binary artwork transfers against the stand-in MPD server
+"""
+
+import asyncio
+import logging
+import os
+import sys
+from os import path
+
+from mpnotd.client import get_artwork, get_client
+
+sys.path.insert(0, path.join(path.dirname(path.dirname(
+    path.abspath(__file__))), "benchmarks"))
+
+import fakempd  # noqa: E402
+
+LOG = logging.getLogger(__name__)
+
+
+def fetch(songs, url, limit, server=fakempd.FakeMPD, **art):
+
+    async def run():
+        fake = server(songs, [], **art)
+        port = await fake.serve()
+
+        client = await get_client({"host": "127.0.0.1", "port": port}, LOG)
+        await client.binarylimit(limit)
+
+        try:
+            return await get_artwork(client, url, LOG)
+        finally:
+            client.disconnect()
+            fake.server.close()
+
+            # Let the server see the hang up before the loop closes
+            await asyncio.sleep(0.05)
+
+    return asyncio.run(run())
+
+
+def test_albumart_chunks():
+    songs = fakempd.make_library(1, 2)
+    cover = os.urandom(10000)
+
+    source, data = fetch(songs, songs[1]["file"], 64,
+                         covers={"Artist 000/Album 000": cover})
+
+    assert source == "mpd:albumart:{}".format(songs[1]["file"])
+    assert isinstance(data, bytearray)
+    assert data == cover
+
+
+def test_readpicture_fallback():
+    songs = fakempd.make_library(1, 2)
+    picture = os.urandom(3000)
+
+    source, data = fetch(songs, songs[0]["file"], 1024,
+                         pictures={songs[0]["file"]: picture})
+
+    assert source.startswith("mpd:readpicture:")
+    assert data == picture
+
+
+def test_no_artwork():
+    songs = fakempd.make_library(1, 2)
+
+    assert fetch(songs, songs[0]["file"], 1024) == (None, None)
+
+
+class Replaced(fakempd.FakeMPD):
+
+    """ Cover file replaced by a smaller one after the first chunk
+    """
+
+    replaced = False
+
+    def cmd_albumart(self, uri, offset):
+        if int(offset) and not self.replaced:
+            self.replaced = True
+            self.covers = {key: data[:len(data) // 2]
+                           for key, data in self.covers.items()}
+        return super().cmd_albumart(uri, offset)
+
+
+def test_cover_replaced_during_transfer():
+    songs = fakempd.make_library(1, 2)
+
+    assert fetch(songs, songs[0]["file"], 64, Replaced,
+                 covers={"Artist 000/Album 000": os.urandom(1000)}) == (
+                     None, None)
@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+
+""" Now playing state socket
+"""
+
+import asyncio
+import logging
+import socket
+from os import path
+
+from mpnotd.nowplaying import NowPlaying
+
+LOG = logging.getLogger(__name__)
+
+
+def test_live_socket_kept(tmp_path):
+    sockpath = path.join(str(tmp_path), "nowplaying.sock")
+
+    async def run():
+        first = NowPlaying("", sockpath, LOG)
+        await first.start()
+
+        second = NowPlaying("", sockpath, LOG)
+        await second.start()
+        second.close()
+
+        # The first daemon still has its subscribers
+        reader, writer = await asyncio.open_unix_connection(sockpath)
+        line = await reader.readline()
+        writer.close()
+        first.close()
+
+        return second.server, line
+
+    server, line = asyncio.run(run())
+
+    assert server is None
+    assert line.startswith(b'{"server": null')
+
+
+def test_stale_socket_replaced(tmp_path):
+    sockpath = path.join(str(tmp_path), "nowplaying.sock")
+
+    # Bound but no longer listening, like after a crash
+    stale = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    stale.bind(sockpath)
+    stale.close()
+
+    async def run():
+        nowplaying = NowPlaying("", sockpath, LOG)
+        await nowplaying.start()
+        listening = nowplaying.server is not None
+        nowplaying.close()
+
+        return listening
+
+    assert asyncio.run(run())
+    assert not path.exists(sockpath)
@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+
+""" QueueMirror against a simulated MPD queue
+"""
+
+import asyncio
+import logging
+import random
+
+from mpnotd.playlist import QueueMirror
+
+LOG = logging.getLogger(__name__)
+
+
+class FakeQueue:
+
+    """ MPD queue answering playlist queries by version
+
+    Every position whose song changed is stamped with the version of
+    the change, as MPD does for plchanges
+    """
+
+    def __init__(self):
+        self.songs = []
+        self.changed = []
+        self.version = 1
+        self.next_id = 0
+        self.drop = 0
+
+    def _commit(self, songs):
+        self.version += 1
+        self.changed = [
+            self.version if pos >= len(self.songs)
+            or self.songs[pos]["id"] != song["id"] else self.changed[pos]
+            for pos, song in enumerate(songs)
+        ]
+        self.songs = songs
+
+    def add(self, pos):
+        self.next_id += 1
+        song = {"id": str(self.next_id), "file": "f{}.mp3".format(
+            self.next_id), "artist": "Artist", "album": "Album"}
+        self._commit(self.songs[:pos] + [song] + self.songs[pos:])
+
+    def delete(self, pos):
+        self._commit(self.songs[:pos] + self.songs[pos + 1:])
+
+    def move(self, src, dst):
+        songs = list(self.songs)
+        songs.insert(dst, songs.pop(src))
+        self._commit(songs)
+
+    async def status(self):
+        return {"playlist": str(self.version),
+                "playlistlength": str(len(self.songs))}
+
+    async def playlistinfo(self):
+        return [dict(song, pos=str(pos))
+                for pos, song in enumerate(self.songs)]
+
+    async def plchanges(self, version):
+        changes = [dict(song, pos=str(pos))
+                   for pos, song in enumerate(self.songs)
+                   if self.changed[pos] > int(version)]
+
+        # Lose deltas, like a mirror that missed a version
+        return changes[self.drop:]
+
+    async def plchangesposid(self, version):
+        return [{"cpos": change["pos"], "id": change["id"]}
+                for change in await self.plchanges(version)]
+
+
+def mirrored(mirror):
+    return [song["id"] for song in mirror.songs]
+
+
+def test_random_edits():
+    rng = random.Random(1)
+    fake = FakeQueue()
+    mirror = QueueMirror(LOG)
+
+    async def run():
+        for _ in range(500):
+            for _ in range(rng.randint(1, 4)):
+                size = len(fake.songs)
+                action = rng.random()
+
+                if size < 2 or action < 0.4:
+                    fake.add(rng.randint(0, size))
+                elif action < 0.7:
+                    fake.delete(rng.randrange(size))
+                else:
+                    fake.move(rng.randrange(size), rng.randrange(size))
+
+            await mirror.sync(fake)
+
+            assert mirrored(mirror) == [song["id"] for song in fake.songs]
+            assert [song["pos"] for song in mirror.songs] == [
+                str(pos) for pos in range(len(fake.songs))]
+
+    asyncio.run(run())
+
+
+def test_gap_reloads_in_same_sync():
+    fake = FakeQueue()
+    mirror = QueueMirror(LOG)
+
+    async def run():
+        for pos in range(5):
+            fake.add(pos)
+        await mirror.sync(fake)
+
+        # Two songs appended, the first one's delta is lost
+        fake.add(5)
+        fake.add(6)
+        fake.drop = 1
+        await mirror.sync(fake)
+        fake.drop = 0
+
+        assert mirrored(mirror) == [song["id"] for song in fake.songs]
+
+        status = dict(await fake.status(), nextsong="1")
+        upcoming = await mirror.upcoming(fake, status, 3)
+
+        assert [song["file"] for song in upcoming] == [
+            "f2.mp3", "f3.mp3", "f4.mp3"]
+
+    asyncio.run(run())
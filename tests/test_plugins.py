@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+
+""" Plugin hooks run in the background
+"""
+
+import asyncio
+import logging
+import subprocess
+import sys
+import time
+from os import path
+
+from mpnotd.plugins import PluginManager
+
+ROOT = path.dirname(path.dirname(path.abspath(__file__)))
+
+# Emits one event to a plugin that never returns, then exits
+HUNG = """
+import asyncio, logging, sys
+from mpnotd.plugins import PluginManager
+
+async def main():
+    plugins = PluginManager(sys.argv[1], logging.getLogger(), 1, 0.2)
+    plugins.load()
+    await plugins.emit("on_song", {"server": "test"})
+    plugins.close()
+
+asyncio.run(main())
+"""
+
+
+def test_hung_hook_does_not_block_exit(tmp_path):
+    plugdir = tmp_path / "plugins"
+    plugdir.mkdir()
+    (plugdir / "hung.py").write_text(
+        "import time\n\ndef on_song(event):\n    time.sleep(60)\n")
+
+    start = time.monotonic()
+    subprocess.run([sys.executable, "-c", HUNG, str(plugdir)], cwd=ROOT,
+                   check=True, timeout=30)
+
+    assert time.monotonic() - start < 10
+
+
+def test_hooks_run_in_order(tmp_path):
+    plugdir = tmp_path / "plugins"
+    plugdir.mkdir()
+    (plugdir / "record.py").write_text(
+        "import random, time\n\nSEEN = []\n\n"
+        "def on_state(event):\n"
+        "    time.sleep(random.random() / 100)\n"
+        "    SEEN.append(event['num'])\n")
+
+    plugins = PluginManager(str(plugdir), logging.getLogger(), 4, 5)
+    plugins.load()
+
+    async def run():
+        await asyncio.gather(*(plugins.emit("on_state", {"num": num})
+                               for num in range(20)))
+
+    asyncio.run(run())
+    plugins.close()
+
+    hook = plugins.plugins["record"]["on_state"]
+    assert hook.__globals__["SEEN"] == list(range(20))
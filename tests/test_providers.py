@@ -0,0 +1,203 @@
+# -*- coding: utf-8 -*-
+
+""" Remote artwork chain against a stand-in HTTP server
+"""
+
+import logging
+import multiprocessing
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from os import path
+
+import pytest
+
+from mpnotd.index import ArtworkIndex
+from mpnotd.providers import (HTTPPool, RateLimit, RemoteArtwork,
+                              RemoteUnavailable, make_providers)
+
+LOG = logging.getLogger(__name__)
+
+COVER = b"\x89PNG\r\n\x1a\n" + bytes(range(256)) * 4
+
+
+class Handler(BaseHTTPRequestHandler):
+
+    """ Answers by path, counting requests and connections
+    """
+
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        super().setup()
+        self.server.connections += 1
+
+    def do_GET(self):
+        self.server.requests.append(self.path)
+
+        if self.path.startswith("/covers/"):
+            self.reply(200, "image/png", COVER)
+        elif self.path.startswith("/moved/"):
+            self.reply(302, "text/plain", b"",
+                       Location=self.path.replace("/moved/", "/covers/"))
+        elif self.path.startswith("/busy/"):
+            self.reply(503, "text/plain", b"busy")
+        elif self.path.startswith("/trickle/"):
+            self.send_response(200)
+            self.send_header("Content-Type", "image/png")
+            self.send_header("Content-Length", str(len(COVER)))
+            self.end_headers()
+
+            for byte in COVER:
+                self.wfile.write(bytes([byte]))
+                self.wfile.flush()
+                time.sleep(0.1)
+        else:
+            self.reply(404, "text/plain", b"missing")
+
+    def reply(self, status, ctype, body, **headers):
+        self.send_response(status)
+        self.send_header("Content-Type", ctype)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    httpd.daemon_threads = True
+    httpd.connections = 0
+    httpd.requests = []
+
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+
+    yield httpd
+
+    httpd.shutdown()
+    httpd.server_close()
+
+
+@pytest.fixture
+def remote(server, tmp_path):
+    chains = []
+
+    def make(route, miss_ttl=3600):
+        url = "http://127.0.0.1:{}/{}/{{artist}}/{{album}}.png".format(
+            server.server_address[1], route)
+        index = ArtworkIndex(path.join(str(tmp_path), "index.db"), miss_ttl)
+        chains.append((RemoteArtwork(make_providers(url), index, LOG,
+                                     timeout=1), index))
+
+        return chains[-1]
+
+    yield make
+
+    for artwork, index in chains:
+        artwork.close()
+        index.close()
+
+
+def test_hit(server, remote):
+    artwork, index = remote("covers")
+
+    url, data = artwork("AC/DC", "Back in Black")
+
+    assert data == COVER
+    assert server.requests == ["/covers/AC%2FDC/Back%20in%20Black.png"]
+
+
+def test_redirect(server, remote):
+    artwork, index = remote("moved")
+
+    url, data = artwork("Artist", "Album")
+
+    assert data == COVER
+    assert server.requests == ["/moved/Artist/Album.png",
+                               "/covers/Artist/Album.png"]
+
+
+def test_miss_kept_for_ttl(server, remote):
+    artwork, index = remote("nothing")
+
+    assert artwork("Artist", "Album") == (None, None)
+    assert artwork("Artist", "Album") == (None, None)
+    assert len(server.requests) == 1
+
+    # Asked again once the miss expired
+    index.miss_ttl = -1
+    assert artwork("Artist", "Album") == (None, None)
+    assert len(server.requests) == 2
+
+
+def test_unavailable_not_stored(server, remote):
+    artwork, index = remote("busy")
+
+    for _ in range(2):
+        with pytest.raises(RemoteUnavailable):
+            artwork("Artist", "Album")
+
+    assert len(server.requests) == 2
+
+
+def test_trickled_body_hits_deadline(server):
+    pool = HTTPPool(timeout=1)
+    url = "http://127.0.0.1:{}/trickle/cover.png".format(
+        server.server_address[1])
+
+    start = time.monotonic()
+
+    with pytest.raises(OSError):
+        pool.get(url)
+
+    assert time.monotonic() - start < 1.5
+
+
+def test_keep_alive_reuse(server):
+    pool = HTTPPool(timeout=1)
+    base = "http://127.0.0.1:{}/".format(server.server_address[1])
+
+    for name in ("covers/a.png", "nothing", "covers/b.png"):
+        pool.get(base + name)
+
+    pool.close()
+
+    assert len(server.requests) == 3
+    assert server.connections == 1
+
+
+def test_unknown_provider():
+    with pytest.raises(ValueError):
+        make_providers("musicbrainz, bogus")
+
+    with pytest.raises(ValueError):
+        make_providers("http://nas/{artist}/{year}.jpg")
+
+
+def _stamp(limit, stamps):
+    for _ in range(2):
+        limit.wait()
+        stamps.put(time.monotonic())
+
+
+def test_rate_limit_shared_by_processes():
+    limit = RateLimit(0.2)
+    stamps = multiprocessing.Queue()
+
+    workers = [multiprocessing.Process(target=_stamp, args=(limit, stamps))
+               for _ in range(2)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+    times = sorted(stamps.get() for _ in range(4))
+
+    assert all(later - earlier >= 0.19
+               for earlier, later in zip(times, times[1:]))
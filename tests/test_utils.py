@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+
+""" Config and server sections
+"""
+
+from os import path
+
+from mpnotd import DEFAULTS
+from mpnotd.utils import load_config, load_servers
+
+
+def load(tmp_path, text):
+    inifile = path.join(str(tmp_path), "config")
+
+    with open(inifile, "w") as config:
+        config.write(text)
+
+    config = load_config("mpnotd", inifile, DEFAULTS)
+
+    return config, load_servers("mpnotd", inifile, config)
+
+
+def test_server_sections_only(tmp_path):
+    config, servers = load(tmp_path, "\n".join([
+        "[mpnotd:living room]",
+        "host = 192.168.1.20",
+        "",
+        "[mpnotd:kitchen]",
+        "host = 192.168.1.21",
+        "cava = 1",
+    ]))
+
+    assert config == DEFAULTS
+    assert [(label, server["host"]) for label, server in servers] == [
+        ("living room", "192.168.1.20"), ("kitchen", "192.168.1.21")]
+    assert servers[1][1]["cava"] == "1"
+
+
+def test_main_section_with_host(tmp_path):
+    config, servers = load(tmp_path, "\n".join([
+        "[mpnotd]",
+        "host = 192.168.1.10",
+        "",
+        "[mpnotd:kitchen]",
+        "host = 192.168.1.21",
+    ]))
+
+    assert [label for label, server in servers] == ["192.168.1.10",
+                                                     "kitchen"]
@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+
+""" Listing the library for --warm-cache
+"""
+
+import asyncio
+import sys
+import threading
+from os import path
+
+from mpnotd.client import get_songinfo
+from mpnotd.warm import list_albums
+
+sys.path.insert(0, path.join(path.dirname(path.dirname(
+    path.abspath(__file__))), "benchmarks"))
+
+import fakempd  # noqa: E402
+
+
+async def stop(fake):
+    fake.server.close()
+
+    # Let the server see the hang up before the loop closes
+    await asyncio.sleep(0.05)
+
+
+def test_list_albums_by_directory():
+    songs = fakempd.make_library(6, 3)
+
+    # The same album tags in a second directory are a second entry
+    songs.append(dict(songs[0], file="Disc 2/01 - Title.flac"))
+
+    loop = asyncio.new_event_loop()
+    fake = fakempd.FakeMPD(songs, [])
+    port = loop.run_until_complete(fake.serve())
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+
+    try:
+        albums = list_albums({"host": "127.0.0.1", "port": port,
+                              "auth": ""})
+    finally:
+        asyncio.run_coroutine_threadsafe(stop(fake), loop).result()
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join()
+        loop.close()
+
+    # Keyed like songs on the popup path
+    expected = {}
+    for song in songs:
+        info = get_songinfo({key.lower(): value
+                             for key, value in song.items()})
+        expected.setdefault((path.dirname(info["file"]), info["artist"],
+                             info["album"]), info["file"])
+
+    assert sorted(albums) == sorted(key + (url, )
+                                    for key, url in expected.items())
@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+
+""" Album dir watching
+"""
+
+import asyncio
+import ctypes
+import ctypes.util
+import logging
+import os
+
+from mpnotd.watch import MusicWatcher
+
+LOG = logging.getLogger(__name__)
+
+
+class FakeIndex:
+
+    def __init__(self, dirs):
+        self.dirs = set(dirs)
+        self.forgotten = []
+
+    def album_dirs(self):
+        return set(self.dirs)
+
+    def forget_dir(self, albumdir, albumkey):
+        self.forgotten.append(albumdir)
+        return 1
+
+
+def watched(musicdir, network):
+
+    async def run():
+        index = FakeIndex(["Artist/Album"])
+        watcher = MusicWatcher(musicdir, index, LOG)
+        watcher.loop = asyncio.get_running_loop()
+        watcher._start_inotify()
+
+        if network:
+            watcher._network_fs = lambda dirpath: True
+
+        try:
+            watcher.refresh()
+
+            # Changed behind inotify's back, e.g. on the NFS server
+            with open(os.path.join(musicdir, "Artist/Album/cover.jpg"),
+                      "wb") as cover:
+                cover.write(b"new")
+            await asyncio.sleep(0.1)
+
+            # inotify events are read by the loop, polled dirs here
+            remote = not watcher.wds
+            watcher.poll()
+            return remote, index.forgotten
+        finally:
+            watcher.close()
+
+    return asyncio.run(run())
+
+
+def test_local_dir_watched(tmp_path):
+    os.makedirs(str(tmp_path / "Artist" / "Album"))
+
+    assert watched(str(tmp_path), False) == (False, ["Artist/Album"])
+
+
+def test_network_dir_polled(tmp_path):
+    os.makedirs(str(tmp_path / "Artist" / "Album"))
+
+    assert watched(str(tmp_path), True) == (True, ["Artist/Album"])
+
+
+def test_local_dir_is_not_network(tmp_path):
+    watcher = MusicWatcher(str(tmp_path), FakeIndex([]), LOG)
+    watcher.libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+
+    assert not watcher._network_fs(os.fsencode(str(tmp_path)))